@@ -1,12 +1,23 @@
-import win32com.client
 import sys
 import traceback
-import pythoncom
 from datetime import datetime, timedelta
 import os
 import re
 import json
+import time
+import hashlib
 import logging
+import sqlite3
+import threading
+import queue
+import heapq
+import itertools
+import mmap
+import gzip
+import imaplib
+import email
+import email.policy
+from email.utils import parseaddr, parsedate_to_datetime
 from collections import defaultdict
 import nltk
 from nltk.tokenize import sent_tokenize, word_tokenize
@@ -18,6 +29,29 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from html import escape
 import ssl
+import outlook_replay
+
+# pywin32 is only needed for the Outlook source; mbox/Maildir exports can be
+# analyzed on hosts without it
+try:
+    import win32com.client
+    import pythoncom
+except ImportError:
+    win32com = None
+    pythoncom = None
+
+# zstandard is only needed for .jsonl.zst chain archives
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# exchangelib is only needed for the EWS source
+try:
+    import exchangelib
+    from exchangelib.protocol import BaseProtocol
+except ImportError:
+    exchangelib = None
 
 # SSL context modification (use with caution)
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -30,6 +64,157 @@ nltk.download('stopwords', quiet=True)
 logging.basicConfig(filename='email_analyzer.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Where emails come from: "outlook" (live MAPI session), an exported "mbox"
+# file / "maildir" directory at MAIL_SOURCE_PATH, an "imap" server, or an
+# Exchange server over "ews"
+MAIL_SOURCE = os.environ.get("MAIL_SOURCE", "outlook")
+MAIL_SOURCE_PATH = os.environ.get("MAIL_SOURCE_PATH", "")
+
+# IMAP source: the server runs SEARCH, headers and bodies are fetched in
+# batches of IMAP_FETCH_BATCH UIDs, and IMAP_CONNECTIONS folders are read at once
+IMAP_HOST = os.environ.get("IMAP_HOST", "")
+IMAP_PORT = int(os.environ.get("IMAP_PORT", "993"))
+IMAP_USER = os.environ.get("IMAP_USER", "")
+IMAP_PASSWORD = os.environ.get("IMAP_PASSWORD", "")
+IMAP_FOLDERS = [name for name in os.environ.get("IMAP_FOLDERS", "").split(",") if name]
+IMAP_FETCH_BATCH = 100
+IMAP_CONNECTIONS = 4
+IMAP_HEADER_FIELDS = "SUBJECT FROM TO CC DATE MESSAGE-ID CONTENT-TYPE CONTENT-TRANSFER-ENCODING MIME-VERSION"
+
+# EWS source: FindItem pages of EWS_PAGE_SIZE, GetItem batches of EWS_CHUNK_SIZE,
+# and one pooled HTTP session per account shared by every search in the run
+EWS_SERVER = os.environ.get("EWS_SERVER", "")
+EWS_USER = os.environ.get("EWS_USER", "")
+EWS_PASSWORD = os.environ.get("EWS_PASSWORD", "")
+EWS_ADDRESS = os.environ.get("EWS_ADDRESS", "") or os.environ.get("MAILBOX_ADDRESS", "") or EWS_USER
+EWS_PAGE_SIZE = 100
+EWS_CHUNK_SIZE = 100
+EWS_POOL_SIZE = 4
+EWS_FIELDS = ("id", "subject", "sender", "datetime_received", "conversation_id", "size",
+              "to_recipients", "cc_recipients", "text_body", "message_id", "parent_folder_id")
+# Mailbox owner's SMTP address, used by person analysis when there is no Outlook session
+MAILBOX_ADDRESS = os.environ.get("MAILBOX_ADDRESS", "")
+
+# Ticket discovery ("*" search): one pass over the mailbox maps every ticket
+# number found in a subject or the first TICKET_SCAN_BYTES of a body to the
+# EntryIDs of the emails that mention it.
+TICKET_PATTERN = re.compile(r'\b((?:INC|RITM|CHG|CTASK)\d+)\b', re.IGNORECASE)
+TICKET_SCAN_BYTES = 8 * 1024
+TICKET_MAP_FILE = "ticket_map.json"
+
+# Exchange senders come back as X.500 DNs; resolved SMTP addresses are cached here
+ADDRESS_CACHE = "address_cache.json"
+
+# Case chains are exported as "jsonl" (one JSON record per email plus a
+# CHAIN_INDEX_SUFFIX sidecar with each email's byte offset, length and date),
+# as "gzip"/"zstd" archives where every email is its own compressed frame, or
+# as the older "text" format with dash separator lines
+CHAIN_FORMAT = "jsonl"
+CHAIN_INDEX_SUFFIX = ".idx"
+CHAIN_EXTENSIONS = {"jsonl": ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+# Quoted-reply de-duplication: every paragraph of a chain is cut into hashed
+# SHINGLE_SIZE-word shingles, and a paragraph whose shingles were already seen
+# earlier in the chain (at least SHINGLE_OVERLAP of them) is dropped before
+# the chain reaches the analyzers
+CHAIN_DEDUP = True
+SHINGLE_SIZE = 5
+SHINGLE_OVERLAP = 0.8
+SHINGLE_BASE = 1000003
+SHINGLE_MODULUS = (1 << 61) - 1
+
+# Boilerplate stripping before export: urldefense links collapse to their
+# host, [EXTERNAL EMAIL] banners go, and lines learned as templates are
+# removed. A line is learned when it sits in the signature/disclaimer block of
+# at least BOILERPLATE_MIN_COUNT different emails, or when at least
+# BOILERPLATE_MIN_SENDERS different senders wrote it. Templates are cached in
+# BOILERPLATE_CACHE together with the last BOILERPLATE_MAX_SEEN emails learned from
+STRIP_BOILERPLATE = True
+BOILERPLATE_CACHE = "boilerplate_templates.json"
+BOILERPLATE_MIN_COUNT = 5
+BOILERPLATE_MIN_SENDERS = 3
+BOILERPLATE_MIN_LENGTH = 12
+BOILERPLATE_MAX_TEMPLATES = 20000
+BOILERPLATE_MAX_SEEN = 50000
+
+# Rough size of an LLM token, used to report how much text de-duplication saved
+CHARS_PER_TOKEN = 4
+
+# Fetch configuration
+# "restrict" walks Items.Restrict per folder; "table" pulls bulk metadata rows
+# through Folder.GetTable and only loads a Body when it is actually read;
+# "mirror" syncs new items into a local SQLite mirror and searches that;
+# "parallel" runs Restrict on FETCH_WORKERS folders at once; "advanced" issues
+# one Application.AdvancedSearch over all default folders and falls back to
+# "restrict" if the search fails or does not complete in time; "stores" also
+# searches shared mailboxes and attached PSTs, one worker thread per store;
+# "conversation" finds seed messages with the planner's filters and then pulls
+# every message of their threads, even replies that never repeat the term.
+FETCH_MODE = "restrict"
+FETCH_WORKERS = 4
+ADVANCED_SEARCH_TIMEOUT = 120
+STORE_TIMEOUT = 120
+OL_MAIL_ITEM = 0
+
+# Query planner: case searches try a subject phrase match and person searches
+# try sender/recipient fields first. The full-text (body) query only runs when
+# the cheap pass finds fewer than PLANNER_MIN_RESULTS emails.
+PLANNER_MIN_RESULTS = 5
+FULL_TEXT_FIELDS = ["subject", "textdescription", "fromname", "fromaddress", "displayto", "displaycc", "displaybcc"]
+PERSON_FIELDS = ["fromname", "fromaddress", "displayto", "displaycc"]
+
+# Adaptive search window: search the last ADAPTIVE_START_DAYS first and grow
+# the window by ADAPTIVE_GROWTH until ADAPTIVE_TARGET emails are found or the
+# horizon (days_back) is reached. Each step only queries the newly added days.
+ADAPTIVE_WINDOW = False
+ADAPTIVE_START_DAYS = 3
+ADAPTIVE_GROWTH = 2
+ADAPTIVE_TARGET = 50
+ADAPTIVE_MAX_DAYS = 90
+
+# Top-N fetch: when set, only the FETCH_LIMIT newest matches are pulled. Each
+# folder is read lazily in date order and reading stops once the N are known.
+FETCH_LIMIT = None
+TABLE_BATCH_SIZE = 500
+PR_SENDER_SMTP_ADDRESS = "http://schemas.microsoft.com/mapi/proptag/0x5D01001F"
+PR_INTERNET_MESSAGE_ID = "http://schemas.microsoft.com/mapi/proptag/0x1035001F"
+# Last time anything in a folder changed; the folder catalogue's change marker
+PR_LOCAL_COMMIT_TIME_MAX = "http://schemas.microsoft.com/mapi/proptag/0x670A0040"
+TABLE_COLUMNS = ["EntryID", "Subject", PR_SENDER_SMTP_ADDRESS, "ReceivedTime", "ConversationID", "Size",
+                 PR_INTERNET_MESSAGE_ID]
+
+# Local mail mirror used by the "mirror" fetch mode. Each folder keeps a
+# watermark so repeat searches only pull items newer than the last sync.
+MIRROR_DB = "mail_mirror.db"
+MIRROR_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# DASL date comparisons are not exact to the second (and may be evaluated in
+# UTC), so re-check a day before the watermark; known EntryIDs are skipped.
+MIRROR_WATERMARK_OVERLAP = timedelta(days=1)
+
+# Folder catalogue used to prune the restrict/table traversal. Subtrees whose
+# newest item predates the search window are skipped without being visited
+# while their catalogue entry is younger than FOLDER_CATALOG_TTL.
+USE_FOLDER_CATALOG = True
+FOLDER_CATALOG = "folder_catalog.json"
+FOLDER_CATALOG_TTL = timedelta(hours=24)
+
+# Replay a recorded snapshot (see outlook_replay.py) instead of connecting to
+# Outlook; every simulated COM call then waits OUTLOOK_REPLAY_LATENCY seconds
+REPLAY_SNAPSHOT = os.environ.get("OUTLOOK_REPLAY", "")
+REPLAY_LATENCY = float(os.environ.get("OUTLOOK_REPLAY_LATENCY", "0"))
+
+# Batch runs share one Outlook session; it is checked at most this often and
+# reconnected if Outlook went away between searches
+SESSION_CHECK_INTERVAL = 30
+
+DEFAULT_FOLDERS = [
+    (6, "Inbox"),
+    (5, "Sent Items"),
+    (3, "Deleted Items"),
+    (4, "Outbox"),
+    (2, "Drafts")
+]
+
 def log(message, level='info'):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}")
     if level == 'info':
@@ -53,6 +238,9 @@ def identify_search_type(search_criteria):
             print("Please enter either 1 for Person or 2 for Case details.")
 
 def connect_to_outlook():
+    if REPLAY_SNAPSHOT:
+        log(f"Replaying Outlook snapshot {REPLAY_SNAPSHOT} ({REPLAY_LATENCY * 1000:.1f} ms per call)")
+        return outlook_replay.ReplayNamespace(REPLAY_SNAPSHOT, REPLAY_LATENCY)
     try:
         log("Connecting to Outlook...")
         outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
@@ -63,75 +251,1465 @@ def connect_to_outlook():
         log("Please ensure Outlook is installed and running.")
         raise
 
-def fetch_emails(outlook, search_criteria, days_back=30):
+class OutlookSession:
+    """One MAPI namespace kept alive across many searches.
+
+    Attribute access is forwarded to the namespace, so a session can be passed
+    anywhere the code expects an Outlook namespace. GetDefaultFolder handles are
+    cached until the session has to reconnect.
+    """
+
+    def __init__(self, connect=connect_to_outlook, check_interval=SESSION_CHECK_INTERVAL):
+        self._connect = connect
+        self.check_interval = check_interval
+        self._namespace = None
+        self._default_folders = {}
+        self._checked = 0
+        self._com_initialized = False
+        self.reconnects = 0
+
+    def open(self):
+        if pythoncom is not None and not self._com_initialized:
+            pythoncom.CoInitialize()
+            self._com_initialized = True
+        return self
+
+    def close(self):
+        self._namespace = None
+        self._default_folders.clear()
+        if self._com_initialized:
+            pythoncom.CoUninitialize()
+            self._com_initialized = False
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _reconnect(self):
+        self._default_folders.clear()
+        self._namespace = self._connect()
+        self._checked = time.time()
+
+    @property
+    def namespace(self):
+        if self._namespace is None:
+            self._reconnect()
+        elif time.time() - self._checked >= self.check_interval:
+            try:
+                self._namespace.Folders.Count
+                self._checked = time.time()
+            except Exception as e:
+                log(f"Outlook session lost ({str(e)}); reconnecting...", 'warning')
+                self.reconnects += 1
+                self._reconnect()
+        return self._namespace
+
+    def GetDefaultFolder(self, folder_const):
+        namespace = self.namespace
+        if folder_const not in self._default_folders:
+            self._default_folders[folder_const] = namespace.GetDefaultFolder(folder_const)
+        return self._default_folders[folder_const]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.namespace, name)
+
+class EmailRecord:
+    """Lightweight stand-in for a MailItem built from bulk metadata.
+
+    Exposes the same attribute names the analysis code reads from a MailItem.
+    The body is only fetched from Outlook the first time Body is accessed.
+    """
+
+    def __init__(self, entry_id, subject, sender, received_time, conversation_id=None,
+                 size=0, folder_path=None, store_id=None, session=None, body=None,
+                 internet_message_id=None, to=None, cc=None, sender_name=None):
+        self.EntryID = entry_id
+        self.Subject = subject
+        self.SenderEmailAddress = sender
+        self.SenderName = sender_name
+        self.ReceivedTime = received_time
+        self.ConversationID = conversation_id
+        self.Size = size
+        self.FolderPath = folder_path
+        self.StoreID = store_id
+        self.Session = session
+        self.InternetMessageID = internet_message_id
+        self.To = to
+        self.CC = cc
+        self._body = body
+
+    @property
+    def Body(self):
+        if self._body is None and self.Session is not None:
+            try:
+                item = self.Session.GetItemFromID(self.EntryID, self.StoreID)
+                self._body = item.Body
+            except Exception as e:
+                log(f"Error loading body for {self.Subject}: {str(e)}", 'warning')
+                self._body = ""
+        return self._body
+
+def dasl_like(fields, criteria):
+    return " OR ".join(f"\"urn:schemas:httpmail:{field}\" LIKE '%{criteria}%'" for field in fields)
+
+def plan_search_filters(criteria, search_type=None, start_date=None, end_date=None):
+    # Cheapest predicate first. The full-text stage overlaps the cheap one (it must
+    # stay free of ci_* operators), so callers drop repeats by EntryID.
+    criteria = criteria.replace("'", "''")
+    date_bound = f"\"urn:schemas:httpmail:datereceived\" >= '{start_date}'"
+    if end_date:
+        date_bound += f" AND \"urn:schemas:httpmail:datereceived\" < '{end_date}'"
+    full = dasl_like(FULL_TEXT_FIELDS, criteria)
+    if search_type == "case":
+        cheap = f"\"urn:schemas:httpmail:subject\" ci_phrasematch '{criteria}'"
+    elif search_type == "person":
+        cheap = dasl_like(PERSON_FIELDS, criteria)
+    else:
+        return [("full-text", f"@SQL=({full}) AND {date_bound}")]
+    return [(f"{search_type} ({'subject' if search_type == 'case' else 'sender/recipient'})",
+             f"@SQL=({cheap}) AND {date_bound}"),
+            ("full-text", f"@SQL=({full}) AND {date_bound}")]
+
+CI_PHRASEMATCH = re.compile(r'"urn:schemas:httpmail:subject" ci_phrasematch \'((?:[^\']|\'\')*)\'')
+
+def dasl_query(query, filter_string):
+    # Stores without Instant Search (PSTs, shared mailboxes in online mode) reject
+    # ci_* operators, so the subject phrase match is retried as a LIKE predicate
     try:
-        log(f"Fetching emails related to '{search_criteria}'...")
-        
-        def search_folder(folder, criteria):
-            messages = []
+        return query(filter_string)
+    except Exception as e:
+        fallback = CI_PHRASEMATCH.sub(lambda match: f"\"urn:schemas:httpmail:subject\" LIKE '%{match.group(1)}%'",
+                                      filter_string)
+        if fallback == filter_string:
+            raise
+        log(f"Content index unavailable ({str(e)}); matching the subject with LIKE instead", 'warning')
+        return query(fallback)
+
+class FolderCatalog:
+    """Persisted per-folder metadata used to avoid needless Restrict calls.
+
+    For every FolderPath the catalogue keeps the EntryID, item count, newest
+    ReceivedTime, the newest ReceivedTime of the whole subtree, when the folder
+    was last seen, and the search terms that found nothing in it (with the
+    oldest window start that was covered).
+    """
+
+    def __init__(self, path=FOLDER_CATALOG):
+        self.path = path
+        self.folders = {}
+        self.observed = {}
+        self.pruned = 0
+        if os.path.exists(path):
             try:
-                # Search current folder
-                folder_items = folder.Items
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.folders = json.load(f)
+            except Exception as e:
+                log(f"Ignoring unreadable folder catalogue {path}: {str(e)}", 'warning')
+
+    def save(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.folders, f, indent=2)
+        except Exception as e:
+            log(f"Error saving folder catalogue {self.path}: {str(e)}", 'warning')
+
+    def observe(self, folder, folder_path=None):
+        folder_path = folder_path or folder.FolderPath
+        # Every planner stage walks the same folders; one observation per search is enough
+        if folder_path in self.observed:
+            return self.observed[folder_path]
+        entry = self.folders.get(folder_path, {})
+        try:
+            changed = str(folder.PropertyAccessor.GetProperty(PR_LOCAL_COMMIT_TIME_MAX))
+        except Exception:
+            changed = None
+        # A deletion plus a new arrival leaves the count unchanged, so the newest
+        # ReceivedTime is re-read whenever the last commit time cannot vouch for the folder
+        if changed is None or entry.get("last_changed") != changed or "item_count" not in entry:
+            folder_items = folder.Items
+            count = folder_items.Count
+            newest = None
+            if count:
                 folder_items.Sort("[ReceivedTime]", True)
-                
-                # Create filter for the current folder
-                start_date = (datetime.now() - timedelta(days=days_back)).strftime("%m/%d/%Y")
-                filter_string = (f"@SQL=("
-                               f"\"urn:schemas:httpmail:subject\" LIKE '%{criteria}%' OR "
-                               f"\"urn:schemas:httpmail:textdescription\" LIKE '%{criteria}%' OR "
-                               f"\"urn:schemas:httpmail:fromname\" LIKE '%{criteria}%' OR "
-                               f"\"urn:schemas:httpmail:fromaddress\" LIKE '%{criteria}%' OR "
-                               f"\"urn:schemas:httpmail:displayto\" LIKE '%{criteria}%' OR "
-                               f"\"urn:schemas:httpmail:displaycc\" LIKE '%{criteria}%' OR "
-                               f"\"urn:schemas:httpmail:displaybcc\" LIKE '%{criteria}%'"
-                               f") AND "
-                               f"\"urn:schemas:httpmail:datereceived\" >= '{start_date}'")
-                
-                filtered_items = folder_items.Restrict(filter_string)
-                messages.extend(list(filtered_items))
-                
-                # Search subfolders recursively
-                for subfolder in folder.Folders:
-                    try:
-                        subfolder_messages = search_folder(subfolder, criteria)
-                        messages.extend(subfolder_messages)
-                    except Exception as e:
-                        log(f"Error searching subfolder {subfolder.Name}: {str(e)}", 'warning')
+                first = folder_items.GetFirst()
+                if first is not None:
+                    newest = to_naive_datetime(first.ReceivedTime).strftime(MIRROR_TIME_FORMAT)
+            # Negative results only stay valid while the folder is provably unchanged
+            if (entry.get("item_count") != count or entry.get("newest_received") != newest
+                    or entry.get("last_changed") != changed):
+                entry["negative"] = {}
+            entry.update(item_count=count, newest_received=newest, last_changed=changed)
+        if "entry_id" not in entry:
+            entry["entry_id"] = folder.EntryID
+        entry["last_seen"] = datetime.now().strftime(MIRROR_TIME_FORMAT)
+        self.folders[folder_path] = entry
+        self.observed[folder_path] = entry
+        return entry
+
+    def can_skip_subtree(self, folder_path, start):
+        entry = self.folders.get(folder_path)
+        if not entry or "subtree_newest" not in entry or "last_seen" not in entry:
+            return False
+        if datetime.now() - datetime.strptime(entry["last_seen"], MIRROR_TIME_FORMAT) > FOLDER_CATALOG_TTL:
+            return False
+        subtree_newest = entry["subtree_newest"]
+        if subtree_newest is None or datetime.strptime(subtree_newest, MIRROR_TIME_FORMAT) < start:
+            self.pruned += 1
+            return True
+        return False
+
+    def can_skip_folder(self, entry, cache_key, start):
+        newest = entry.get("newest_received")
+        if newest is None or datetime.strptime(newest, MIRROR_TIME_FORMAT) < start:
+            return True
+        if cache_key is None:
+            return False
+        # Folder unchanged since a search over a window at least this wide found nothing
+        negative = entry.get("negative", {}).get(cache_key)
+        return negative is not None and datetime.strptime(negative, MIRROR_TIME_FORMAT) <= start
+
+    def record_result(self, folder_path, cache_key, start, found):
+        if cache_key is None:
+            return
+        negative = self.folders[folder_path].setdefault("negative", {})
+        if found:
+            negative.pop(cache_key, None)
+        elif cache_key not in negative or datetime.strptime(negative[cache_key], MIRROR_TIME_FORMAT) > start:
+            negative[cache_key] = start.strftime(MIRROR_TIME_FORMAT)
+
+    def finish_subtree(self, folder_path, child_paths):
+        entry = self.folders.get(folder_path)
+        if entry is None:
+            return
+        newest = [entry.get("newest_received")]
+        newest.extend(self.folders.get(path, {}).get("subtree_newest") for path in child_paths)
+        newest = [value for value in newest if value]
+        entry["subtree_newest"] = max(newest) if newest else None
+
+def search_folder_table(outlook, folder, filter_string, catalog=None, cache_key=None, start=None,
+                        folder_path=None):
+    try:
+        folder_path = folder_path or folder.FolderPath
+        entry = catalog.observe(folder, folder_path) if catalog else None
+        if entry is not None and catalog.can_skip_folder(entry, cache_key, start):
+            catalog.pruned += 1
+        else:
+            # One GetTable call returns the metadata for every matching item in the folder
+            table = dasl_query(lambda query: folder.GetTable(query, 0), filter_string)
+            table.Columns.RemoveAll()
+            for column in TABLE_COLUMNS:
+                table.Columns.Add(column)
+            table.Sort("ReceivedTime", True)
+
+            store_id = folder.StoreID
+            found = 0
+            while not table.EndOfTable:
+                rows = table.GetArray(TABLE_BATCH_SIZE)
+                if not rows:
+                    break
+                for entry_id, subject, sender, received_time, conversation_id, size, message_id in rows:
+                    yield EmailRecord(entry_id, subject, sender, received_time, conversation_id, size,
+                                      folder_path, store_id, outlook, internet_message_id=message_id)
+                    found += 1
+            if catalog:
+                catalog.record_result(folder_path, cache_key, start, found)
+
+        # Search subfolders recursively
+        child_paths = []
+        for subfolder in folder.Folders:
+            try:
+                if catalog:
+                    child_path = subfolder.FolderPath
+                    child_paths.append(child_path)
+                    if catalog.can_skip_subtree(child_path, start):
                         continue
-                
+                else:
+                    child_path = None
+                yield from search_folder_table(outlook, subfolder, filter_string, catalog, cache_key, start,
+                                               child_path)
             except Exception as e:
-                log(f"Error searching folder {folder.Name}: {str(e)}", 'warning')
-            
-            return messages
-        
-        all_messages = []
-        folders_to_search = [
-            (6, "Inbox"),
-            (5, "Sent Items"),
-            (3, "Deleted Items"),
-            (4, "Outbox"),
-            (2, "Drafts")
-        ]
-        
-        for folder_const, folder_name in folders_to_search:
+                log(f"Error searching subfolder {subfolder.Name}: {str(e)}", 'warning')
+                continue
+        if catalog:
+            catalog.finish_subtree(folder_path, child_paths)
+
+    except Exception as e:
+        log(f"Error searching folder {folder.Name}: {str(e)}", 'warning')
+
+def normalize_body(body):
+    body = (body or "").replace("\r\n", "\n").replace("\r", "\n")
+    body = "\n".join(line.rstrip() for line in body.split("\n"))
+    return re.sub(r'\n{3,}', '\n\n', body).strip()
+
+def to_naive_datetime(value):
+    return datetime(value.year, value.month, value.day, value.hour, value.minute, value.second)
+
+class MailMirror:
+    """SQLite copy of the mailbox with a per-folder sync watermark.
+
+    Items are keyed by EntryID. sync_state records, per folder path, the oldest
+    date that has been mirrored (synced_from) and the newest item seen
+    (watermark), so a sync only asks Outlook for what the mirror is missing.
+    """
+
+    def __init__(self, db_path=MIRROR_DB):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                entry_id TEXT PRIMARY KEY,
+                internet_message_id TEXT,
+                store_id TEXT,
+                folder_path TEXT,
+                subject TEXT,
+                sender TEXT,
+                sender_name TEXT,
+                display_to TEXT,
+                display_cc TEXT,
+                received_time TEXT,
+                conversation_id TEXT,
+                size INTEGER,
+                body TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_received ON messages(received_time);
+            CREATE INDEX IF NOT EXISTS idx_messages_message_id ON messages(internet_message_id);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                folder_path TEXT PRIMARY KEY,
+                synced_from TEXT,
+                watermark TEXT
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def get_sync_state(self, folder_path):
+        row = self.conn.execute("SELECT synced_from, watermark FROM sync_state WHERE folder_path = ?",
+                                (folder_path,)).fetchone()
+        if not row:
+            return None, None
+        return (datetime.strptime(row[0], MIRROR_TIME_FORMAT),
+                datetime.strptime(row[1], MIRROR_TIME_FORMAT) if row[1] else None)
+
+    def set_sync_state(self, folder_path, synced_from, watermark):
+        self.conn.execute("INSERT OR REPLACE INTO sync_state (folder_path, synced_from, watermark) VALUES (?, ?, ?)",
+                          (folder_path, synced_from.strftime(MIRROR_TIME_FORMAT),
+                           watermark.strftime(MIRROR_TIME_FORMAT) if watermark else None))
+
+    def has_entry(self, entry_id):
+        return self.conn.execute("SELECT 1 FROM messages WHERE entry_id = ?", (entry_id,)).fetchone() is not None
+
+    def store_item(self, item, folder_path, store_id):
+        try:
+            internet_message_id = item.PropertyAccessor.GetProperty(PR_INTERNET_MESSAGE_ID)
+        except Exception:
+            internet_message_id = None
+        received_time = to_naive_datetime(item.ReceivedTime)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO messages (entry_id, internet_message_id, store_id, folder_path, subject, sender, "
+            "sender_name, display_to, display_cc, received_time, conversation_id, size, body) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (item.EntryID, internet_message_id, store_id, folder_path, item.Subject, item.SenderEmailAddress,
+             item.SenderName, item.To, item.CC, received_time.strftime(MIRROR_TIME_FORMAT),
+             item.ConversationID, item.Size, normalize_body(item.Body)))
+        return received_time
+
+    def pull_items(self, folder, start, end=None):
+        folder_path = folder.FolderPath
+        store_id = folder.StoreID
+        filter_string = f"@SQL=\"urn:schemas:httpmail:datereceived\" >= '{start.strftime('%m/%d/%Y %I:%M %p')}'"
+        if end is not None:
+            filter_string += f" AND \"urn:schemas:httpmail:datereceived\" < '{end.strftime('%m/%d/%Y %I:%M %p')}'"
+        newest = None
+        pulled = 0
+        for item in folder.Items.Restrict(filter_string):
+            try:
+                if self.has_entry(item.EntryID):
+                    continue
+                received_time = self.store_item(item, folder_path, store_id)
+                pulled += 1
+                if newest is None or received_time > newest:
+                    newest = received_time
+            except Exception as e:
+                # Meeting requests, reports etc. lack some MailItem properties
+                log(f"Skipping item in {folder_path}: {str(e)}", 'warning')
+                continue
+        return pulled, newest
+
+    def sync_folder(self, folder, start):
+        folder_path = folder.FolderPath
+        synced_from, watermark = self.get_sync_state(folder_path)
+        pulled = 0
+        if synced_from is None:
+            pulled, watermark = self.pull_items(folder, start)
+            synced_from = start
+        else:
+            if start < synced_from:
+                # The window now reaches further back than anything mirrored so far
+                count, _ = self.pull_items(folder, start, synced_from)
+                pulled += count
+                synced_from = start
+            since = (watermark or synced_from) - MIRROR_WATERMARK_OVERLAP
+            count, newest = self.pull_items(folder, max(since, synced_from))
+            pulled += count
+            if newest is not None and (watermark is None or newest > watermark):
+                watermark = newest
+        self.set_sync_state(folder_path, synced_from, watermark)
+        self.conn.commit()
+        return pulled
+
+    def sync_tree(self, folder, start):
+        pulled = 0
+        try:
+            pulled += self.sync_folder(folder, start)
+            for subfolder in folder.Folders:
+                pulled += self.sync_tree(subfolder, start)
+        except Exception as e:
+            log(f"Error syncing folder {folder.Name}: {str(e)}", 'warning')
+        return pulled
+
+    def search(self, criteria, start, session=None, folder_prefixes=(), limit=None):
+        pattern = f"%{criteria}%"
+        query = ("SELECT entry_id, subject, sender, received_time, conversation_id, size, folder_path, store_id, "
+                 "body, internet_message_id, display_to, display_cc FROM messages WHERE received_time >= ? AND "
+                 "(subject LIKE ? OR body LIKE ? OR sender LIKE ? OR sender_name LIKE ? OR "
+                 "display_to LIKE ? OR display_cc LIKE ?)")
+        params = [start.strftime(MIRROR_TIME_FORMAT)] + [pattern] * 6
+        if folder_prefixes:
+            query += " AND (" + " OR ".join(["folder_path = ? OR folder_path LIKE ?"] * len(folder_prefixes)) + ")"
+            for folder_prefix in folder_prefixes:
+                params.extend([folder_prefix, folder_prefix + "\\%"])
+        query += " ORDER BY received_time DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        for (entry_id, subject, sender, received_time, conversation_id, size, folder_path, store_id,
+             body, internet_message_id, display_to, display_cc) in self.conn.execute(query, params):
+            yield EmailRecord(entry_id, subject, sender, datetime.strptime(received_time, MIRROR_TIME_FORMAT),
+                              conversation_id, size, folder_path, store_id, session, body, internet_message_id,
+                              display_to, display_cc)
+
+def fetch_emails_mirror(outlook, search_criteria, days_back=30, mirror=None, limit=None):
+    own_mirror = mirror is None
+    mirror = mirror or MailMirror()
+    try:
+        start = datetime.now() - timedelta(days=days_back)
+        synced = []
+        for folder_const, folder_name in DEFAULT_FOLDERS:
             try:
-                log(f"Searching in {folder_name} and its subfolders...")
                 root_folder = outlook.GetDefaultFolder(folder_const)
-                folder_messages = search_folder(root_folder, search_criteria)
-                all_messages.extend(folder_messages)
-                log(f"Found {len(folder_messages)} emails in {folder_name} and its subfolders")
+                pulled = mirror.sync_tree(root_folder, start)
+                log(f"Synced {pulled} new emails from {folder_name} into the mirror")
+                if limit:
+                    synced.append(root_folder.FolderPath)
+                    continue
+                found = 0
+                for record in mirror.search(search_criteria, start, outlook, [root_folder.FolderPath]):
+                    yield record
+                    found += 1
+                log(f"Found {found} emails in {folder_name} and its subfolders")
             except Exception as e:
                 log(f"Error searching {folder_name}: {str(e)}", 'error')
                 continue
+        if limit and synced:
+            # Per-folder results are only newest-first within each folder, so the
+            # latest N across all folders needs one query over all of them
+            yield from mirror.search(search_criteria, start, outlook, synced, limit)
+    finally:
+        if own_mirror:
+            mirror.close()
+
+def create_worker_namespace():
+    if REPLAY_SNAPSHOT:
+        return outlook_replay.ReplayNamespace(REPLAY_SNAPSHOT, REPLAY_LATENCY)
+    return win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
+
+def collect_folder_tree(folder, folders=None):
+    if folders is None:
+        folders = []
+    try:
+        folders.append((folder.FolderPath, folder.EntryID, folder.StoreID))
+        for subfolder in folder.Folders:
+            collect_folder_tree(subfolder, folders)
+    except Exception as e:
+        log(f"Error listing folder {folder.Name}: {str(e)}", 'warning')
+    return folders
+
+def restrict_folder_records(namespace, folder_path, entry_id, store_id, filter_string):
+    folder = namespace.GetFolderFromID(entry_id, store_id)
+    return copy_restricted_records(folder, folder_path, store_id, filter_string)
+
+def copy_restricted_records(folder, folder_path, store_id, filter_string):
+    folder_items = dasl_query(folder.Items.Restrict, filter_string)
+    folder_items.Sort("[ReceivedTime]", True)
+    records = []
+    for item in folder_items:
+        try:
+            # Drafts, Outbox and other unsent items have no Internet message ID yet
+            message_id = item.PropertyAccessor.GetProperty(PR_INTERNET_MESSAGE_ID)
+        except Exception:
+            message_id = None
+        try:
+            # COM objects cannot leave the worker's apartment, so copy the metadata out
+            records.append(EmailRecord(item.EntryID, item.Subject, item.SenderEmailAddress, item.ReceivedTime,
+                                       item.ConversationID, item.Size, folder_path, store_id,
+                                       internet_message_id=message_id))
+        except Exception as e:
+            log(f"Skipping item in {folder_path}: {str(e)}", 'warning')
+    return records
+
+def search_folders_concurrently(folders, filter_string, workers=FETCH_WORKERS,
+                                namespace_factory=create_worker_namespace):
+    tasks = queue.Queue()
+    for index, folder in enumerate(folders):
+        tasks.put((index, folder))
+    results = {}
+
+    def worker():
+        # Every thread needs its own COM apartment and its own MAPI namespace
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            namespace = namespace_factory()
+            while True:
+                try:
+                    index, (folder_path, entry_id, store_id) = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[index] = restrict_folder_records(namespace, folder_path, entry_id, store_id, filter_string)
+                except Exception as e:
+                    log(f"Error searching folder {folder_path}: {str(e)}", 'warning')
+        except Exception as e:
+            log(f"Search worker failed: {str(e)}", 'error')
+        finally:
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(workers, len(folders))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Each folder's records are already newest-first, so a k-way merge keeps that order
+    return list(heapq.merge(*(results.get(index, []) for index in range(len(folders))),
+                            key=lambda record: record.ReceivedTime, reverse=True))
+
+def collect_store_roots(outlook):
+    # The primary mailbox is searched through its default folders as usual;
+    # shared mailboxes and PSTs are searched from their root folder down
+    default_store_id = outlook.DefaultStore.StoreID
+    stores = []
+    for store in outlook.Stores:
+        try:
+            if store.StoreID == default_store_id:
+                folder_ids = [outlook.GetDefaultFolder(folder_const).EntryID for folder_const, _ in DEFAULT_FOLDERS]
+            else:
+                folder_ids = [store.GetRootFolder().EntryID]
+            stores.append((store.DisplayName, store.StoreID, folder_ids))
+        except Exception as e:
+            log(f"Skipping store {store.DisplayName}: {str(e)}", 'warning')
+    return stores
+
+def search_store(namespace, store_id, folder_ids, filter_string):
+    folder_results = []
+
+    def walk(folder):
+        try:
+            if folder.DefaultItemType == OL_MAIL_ITEM:
+                folder_results.append(copy_restricted_records(folder, folder.FolderPath, store_id, filter_string))
+            for subfolder in folder.Folders:
+                walk(subfolder)
+        except Exception as e:
+            log(f"Error searching folder {folder.Name}: {str(e)}", 'warning')
+
+    for entry_id in folder_ids:
+        walk(namespace.GetFolderFromID(entry_id, store_id))
+    return list(heapq.merge(*folder_results, key=lambda record: record.ReceivedTime, reverse=True))
+
+def search_stores_concurrently(outlook, filter_string, timeout=STORE_TIMEOUT,
+                               namespace_factory=create_worker_namespace):
+    stores = collect_store_roots(outlook)
+    results = {}
+
+    def worker(index, store_name, store_id, folder_ids):
+        # One COM apartment and MAPI namespace per store worker
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            results[index] = search_store(namespace_factory(), store_id, folder_ids, filter_string)
+            log(f"Found {len(results[index])} emails in store {store_name}")
+        except Exception as e:
+            log(f"Error searching store {store_name}: {str(e)}", 'error')
+        finally:
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+    log(f"Searching {len(stores)} stores concurrently...")
+    threads = [threading.Thread(target=worker, args=(index,) + store, daemon=True)
+               for index, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    # All stores start together, so one deadline gives each store the same timeout
+    deadline = time.time() + timeout
+    for thread, (store_name, _, _) in zip(threads, stores):
+        thread.join(max(0, deadline - time.time()))
+        if thread.is_alive():
+            log(f"Store {store_name} did not finish within {timeout} seconds; skipping its results", 'warning')
+
+    all_messages = list(heapq.merge(*(results.get(index, []) for index in range(len(stores)) if not threads[index].is_alive()),
+                                    key=lambda record: record.ReceivedTime, reverse=True))
+    for record in all_messages:
+        record.Session = outlook
+    return all_messages
+
+def fetch_emails_parallel(outlook, filter_string, workers=FETCH_WORKERS):
+    folders = []
+    for folder_const, folder_name in DEFAULT_FOLDERS:
+        try:
+            collect_folder_tree(outlook.GetDefaultFolder(folder_const), folders)
+        except Exception as e:
+            log(f"Error listing {folder_name}: {str(e)}", 'error')
+    log(f"Searching {len(folders)} folders with {workers} workers...")
+    all_messages = search_folders_concurrently(folders, filter_string, workers)
+    for record in all_messages:
+        record.Session = outlook
+    log(f"Total emails found across all folders and subfolders: {len(all_messages)}")
+    return all_messages
+
+class AdvancedSearchEvents:
+    """Outlook.Application event sink that records finished AdvancedSearch tags."""
+
+    completed_tags = set()
+
+    def OnAdvancedSearchComplete(self, search_object):
+        AdvancedSearchEvents.completed_tags.add(search_object.Tag)
+
+def fetch_emails_advanced(outlook, filter_string, application=None, timeout=ADVANCED_SEARCH_TIMEOUT):
+    if application is None:
+        application = win32com.client.DispatchWithEvents("Outlook.Application", AdvancedSearchEvents)
+    # All default folders live in the primary store, so one scope string covers them
+    scope = ",".join(f"'{outlook.GetDefaultFolder(folder_const).FolderPath}'"
+                     for folder_const, _ in DEFAULT_FOLDERS)
+    tag = f"email_analyzer_{time.time_ns()}"
+    # AdvancedSearch takes the DASL condition without the @SQL= prefix
+    search = application.AdvancedSearch(scope, filter_string[len("@SQL="):], True, tag)
+
+    deadline = time.time() + timeout
+    while tag not in AdvancedSearchEvents.completed_tags:
+        if time.time() > deadline:
+            search.Stop()
+            raise TimeoutError(f"AdvancedSearch did not complete within {timeout} seconds")
+        pythoncom.PumpWaitingMessages()
+        time.sleep(0.05)
+    AdvancedSearchEvents.completed_tags.discard(tag)
+
+    all_messages = []
+    for item in search.Results:
+        all_messages.append(item)
+    log(f"Total emails found by AdvancedSearch: {len(all_messages)}")
+    return all_messages
+
+def benchmark_fetch_modes(outlook, search_criteria, days_back=30, modes=("restrict", "advanced"), repeats=3):
+    results = {}
+    for mode in modes:
+        timings = []
+        count = 0
+        for _ in range(repeats):
+            start_time = time.time()
+            count = len(fetch_emails(outlook, search_criteria, days_back, mode=mode, use_catalog=False))
+            timings.append(time.time() - start_time)
+        results[mode] = {"count": count, "best": min(timings), "mean": sum(timings) / len(timings)}
+
+    print(f"\nFetch benchmark for '{search_criteria}' ({days_back} days, {repeats} runs each):")
+    print(f"{'Mode':<10} | {'Emails':>6} | {'Best (s)':>9} | {'Mean (s)':>9}")
+    for mode, result in results.items():
+        print(f"{mode:<10} | {result['count']:>6} | {result['best']:>9.3f} | {result['mean']:>9.3f}")
+    return results
+
+def plan_search_windows(days_back, adaptive=False):
+    def day_start(days):
+        day = datetime.now() - timedelta(days=days)
+        return datetime(day.year, day.month, day.day)
+
+    if not adaptive:
+        return [(day_start(days_back), None)]
+    # Newest slice first; every later slice ends where the previous one started
+    windows = []
+    end = None
+    days = ADAPTIVE_START_DAYS
+    while True:
+        days = min(days, days_back)
+        start = day_start(days)
+        windows.append((start, end))
+        if days >= days_back:
+            break
+        end = start
+        days *= ADAPTIVE_GROWTH
+    return windows
+
+def search_default_folders(outlook, filter_string, mode=FETCH_MODE, catalog=None, cache_key=None, start=None):
+    if mode == "parallel":
+        yield from fetch_emails_parallel(outlook, filter_string)
+        return
+    if mode == "stores":
+        yield from search_stores_concurrently(outlook, filter_string)
+        return
+    if mode == "advanced":
+        try:
+            messages = fetch_emails_advanced(outlook, filter_string)
+        except Exception as e:
+            log(f"AdvancedSearch failed, falling back to folder search: {str(e)}", 'warning')
+        else:
+            yield from messages
+            return
+
+    def search_folder(folder, folder_path=None):
+        try:
+            # Search current folder
+            if catalog:
+                folder_path = folder_path or folder.FolderPath
+            entry = catalog.observe(folder, folder_path) if catalog else None
+            if entry is not None and catalog.can_skip_folder(entry, cache_key, start):
+                catalog.pruned += 1
+            else:
+                folder_items = folder.Items
+                folder_items.Sort("[ReceivedTime]", True)
+                filtered_items = list(dasl_query(folder_items.Restrict, filter_string))
+                yield from filtered_items
+                if catalog:
+                    catalog.record_result(folder_path, cache_key, start, len(filtered_items))
+            
+            # Search subfolders recursively
+            child_paths = []
+            for subfolder in folder.Folders:
+                try:
+                    if catalog:
+                        child_path = subfolder.FolderPath
+                        child_paths.append(child_path)
+                        if catalog.can_skip_subtree(child_path, start):
+                            continue
+                    else:
+                        child_path = None
+                    yield from search_folder(subfolder, child_path)
+                except Exception as e:
+                    log(f"Error searching subfolder {subfolder.Name}: {str(e)}", 'warning')
+                    continue
+            if catalog:
+                catalog.finish_subtree(folder_path, child_paths)
+            
+        except Exception as e:
+            log(f"Error searching folder {folder.Name}: {str(e)}", 'warning')
+    
+    for folder_const, folder_name in DEFAULT_FOLDERS:
+        try:
+            log(f"Searching in {folder_name} and its subfolders...")
+            root_folder = outlook.GetDefaultFolder(folder_const)
+            if mode == "table":
+                folder_messages = search_folder_table(outlook, root_folder, filter_string,
+                                                      catalog, cache_key, start)
+            else:
+                folder_messages = search_folder(root_folder)
+            found = 0
+            for message in folder_messages:
+                yield message
+                found += 1
+            log(f"Found {found} emails in {folder_name} and its subfolders")
+        except Exception as e:
+            log(f"Error searching {folder_name}: {str(e)}", 'error')
+            continue
+
+def iter_restricted_newest_first(folder, filter_string):
+    # GetFirst/GetNext pull one item per call, so nothing past the items the
+    # merge actually consumes is ever read from the folder
+    try:
+        items = dasl_query(folder.Items.Restrict, filter_string)
+        items.Sort("[ReceivedTime]", True)
+        item = items.GetFirst()
+    except Exception as e:
+        log(f"Error searching folder {folder.Name}: {str(e)}", 'warning')
+        return
+    while item is not None:
+        yield item
+        item = items.GetNext()
+
+def collect_mail_folders(folder, folders):
+    try:
+        folders.append(folder)
+        for subfolder in folder.Folders:
+            collect_mail_folders(subfolder, folders)
+    except Exception as e:
+        log(f"Error listing folder {folder.Name}: {str(e)}", 'warning')
+    return folders
+
+def fetch_latest_emails(outlook, search_criteria, days_back=30, limit=FETCH_LIMIT):
+    start_date = (datetime.now() - timedelta(days=days_back)).strftime("%m/%d/%Y")
+    # The full-text filter is a superset of the cheap stages, so it alone covers them
+    (_, filter_string), = plan_search_filters(search_criteria, None, start_date)
+    folders = []
+    for folder_const, folder_name in DEFAULT_FOLDERS:
+        try:
+            collect_mail_folders(outlook.GetDefaultFolder(folder_const), folders)
+        except Exception as e:
+            log(f"Error listing {folder_name}: {str(e)}", 'error')
+    log(f"Reading the {limit} newest matches from {len(folders)} folders...")
+    # k-way merge of the per-folder streams; each stream only advances when its
+    # head is taken, so the merge stops reading as soon as the top N are settled
+    newest = heapq.merge(*(iter_restricted_newest_first(folder, filter_string) for folder in folders),
+                         key=lambda item: to_naive_datetime(item.ReceivedTime), reverse=True)
+    yield from itertools.islice(newest, limit)
+
+def iter_conversation_table(outlook, seed):
+    # Conversation.GetTable lists the thread across every folder of the seed's store
+    conversation = seed.GetConversation()
+    if conversation is None:
+        raise ValueError("store does not support conversations")
+    table = conversation.GetTable()
+    table.Columns.RemoveAll()
+    table.Columns.Add("EntryID")
+    store_id = seed.Parent.StoreID
+    while not table.EndOfTable:
+        rows = table.GetArray(TABLE_BATCH_SIZE)
+        if not rows:
+            break
+        for (entry_id,) in rows:
+            yield outlook.GetItemFromID(entry_id, store_id)
+
+def iter_conversation_restrict(outlook, seeds, covered=None):
+    # One Restrict per folder covers every thread: thread-topic is an indexed
+    # equality match, and ConversationID then drops unrelated threads that
+    # happen to share a topic. covered maps a ConversationID to the store whose
+    # conversation table already listed that thread.
+    covered = covered or {}
+    try:
+        stores = collect_store_roots(outlook)
+    except Exception as e:
+        log(f"Could not list stores for topic matching: {str(e)}", 'warning')
+        return
+
+    def walk(folder, filter_string, conversation_ids):
+        try:
+            if folder.DefaultItemType == OL_MAIL_ITEM:
+                for item in folder.Items.Restrict(filter_string):
+                    if item.ConversationID in conversation_ids:
+                        yield item
+            for subfolder in folder.Folders:
+                yield from walk(subfolder, filter_string, conversation_ids)
+        except Exception as e:
+            log(f"Error searching folder {folder.Name}: {str(e)}", 'warning')
+
+    for store_name, store_id, folder_ids in stores:
+        pending = {conversation_id: seed for conversation_id, seed in seeds.items()
+                   if covered.get(conversation_id) != store_id}
+        if not pending:
+            continue
+        topics = sorted({(seed.ConversationTopic or "").replace("'", "''") for seed in pending.values()})
+        filter_string = "@SQL=" + " OR ".join(f"\"urn:schemas:httpmail:thread-topic\" = '{topic}'"
+                                              for topic in topics)
+        for entry_id in folder_ids:
+            yield from walk(outlook.GetFolderFromID(entry_id, store_id), filter_string, set(pending))
+
+def fetch_emails_conversation(outlook, search_criteria, days_back=30, search_type=None):
+    start = datetime.now() - timedelta(days=days_back)
+    start = datetime(start.year, start.month, start.day)
+    # The full-text stage only runs when the cheap stage found no seed at all
+    matches = []
+    for stage, filter_string in plan_search_filters(search_criteria, search_type, start.strftime("%m/%d/%Y")):
+        log(f"Looking for seed messages with the {stage} query...")
+        matches.extend(search_default_folders(outlook, filter_string, "restrict", start=start))
+        if matches:
+            break
+    seeds = {}
+    for message in matches:
+        seeds.setdefault(message.ConversationID, message)
+    log(f"Found {len(matches)} emails in {len(seeds)} conversations; pulling their threads...")
+    seen = set()
+    covered = {}
+
+    def unseen(messages):
+        for message in messages:
+            if message.EntryID not in seen:
+                seen.add(message.EntryID)
+                yield message
+
+    # Every direct match is kept, even if the thread lookups below fail
+    yield from unseen(matches)
+    for conversation_id, seed in seeds.items():
+        try:
+            thread = list(iter_conversation_table(outlook, seed))
+        except Exception as e:
+            log(f"Conversation view unavailable ({str(e)}); matching the thread by topic", 'warning')
+            continue
+        # A conversation only spans one store; other stores are matched by topic
+        covered[conversation_id] = seed.Parent.StoreID
+        yield from unseen(thread)
+    yield from unseen(iter_conversation_restrict(outlook, seeds, covered))
+    log(f"Total emails found across {len(seeds)} conversations: {len(seen)}")
+
+def iter_emails(outlook, search_criteria, days_back=30, mode=FETCH_MODE, use_catalog=USE_FOLDER_CATALOG,
+                search_type=None, adaptive=ADAPTIVE_WINDOW, target=ADAPTIVE_TARGET, limit=FETCH_LIMIT):
+    # Yields each folder's matches as soon as its query returns, so the caller can
+    # export one folder while the next one is being searched
+    log(f"Fetching emails related to '{search_criteria}'...")
+    if mode == "mirror":
+        yield from fetch_emails_mirror(outlook, search_criteria, days_back, limit=limit)
+        return
+    if limit:
+        if mode != "restrict" or search_type:
+            log(f"Fetching the latest {limit} emails; ignoring mode '{mode}' and search type '{search_type}'",
+                'warning')
+        yield from fetch_latest_emails(outlook, search_criteria, days_back, limit)
+        return
+    if mode == "conversation":
+        yield from fetch_emails_conversation(outlook, search_criteria, days_back, search_type)
+        return
+    catalog = FolderCatalog() if use_catalog else None
+    found = 0
+    seen = set()
+    try:
+        # Window boundaries are whole days, matching the date-only DASL filter
+        for start, end in plan_search_windows(days_back, adaptive):
+            if adaptive and found >= target:
+                log(f"Found {found} emails, not widening the window further")
+                break
+            start_date = start.strftime("%m/%d/%Y")
+            end_date = end.strftime("%m/%d/%Y") if end else None
+            if adaptive:
+                log(f"Searching {start_date} to {end_date or 'now'}...")
+            stages = plan_search_filters(search_criteria, search_type, start_date, end_date)
+            for index, (stage, filter_string) in enumerate(stages):
+                if index > 0 and found >= PLANNER_MIN_RESULTS:
+                    log(f"Skipping {stage} query: {found} emails already found")
+                    break
+                log(f"Running {stage} query...")
+                # A miss inside a bounded slice says nothing about newer mail, so only
+                # open-ended windows may record negative results in the catalogue
+                cache_key = f"{stage}:{search_criteria.lower()}" if end is None else None
+                for message in search_default_folders(outlook, filter_string, mode, catalog, cache_key, start):
+                    # The full-text stage also matches what the cheap stage returned
+                    if message.EntryID in seen:
+                        continue
+                    seen.add(message.EntryID)
+                    yield message
+                    found += 1
         
-        log(f"Total emails found across all folders and subfolders: {len(all_messages)}")
-        return all_messages
-        
+        if catalog:
+            log(f"Folder catalogue pruned {catalog.pruned} folder searches")
+        log(f"Total emails found across all folders and subfolders: {found}")
+    finally:
+        if catalog:
+            catalog.save()
+
+def fetch_emails(outlook, search_criteria, days_back=30, mode=FETCH_MODE, use_catalog=USE_FOLDER_CATALOG,
+                 search_type=None, adaptive=ADAPTIVE_WINDOW, target=ADAPTIVE_TARGET, limit=FETCH_LIMIT):
+    try:
+        return list(iter_emails(outlook, search_criteria, days_back, mode, use_catalog,
+                                search_type, adaptive, target, limit))
     except Exception as e:
         log(f"Error fetching emails: {str(e)}", 'error')
         raise
 
-def analyze_person_emails(messages):
+MBOX_SEPARATOR = re.compile(rb'^From ', re.MULTILINE)
+ENCODED_PART = re.compile(rb'Content-Transfer-Encoding:\s*(?:base64|quoted-printable)', re.IGNORECASE)
+ENCODED_WORD = re.compile(rb'=\?[^?\s]+\?[BQbq]\?')
+HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+def iter_mbox_spans(buffer):
+    # (start, end) byte offsets of each message, found without copying the file
+    start = None
+    for match in MBOX_SEPARATOR.finditer(buffer):
+        if start is not None:
+            yield start, match.start()
+        start = match.start()
+    if start is not None:
+        yield start, len(buffer)
+
+def may_contain(buffer, term_pattern, start=0, end=None):
+    # Cheap byte-level test; encoded parts and RFC 2047 encoded-word headers
+    # (=?utf-8?B?...?=) can hide the term, so those are always parsed
+    end = len(buffer) if end is None else end
+    if term_pattern.search(buffer, start, end) or ENCODED_PART.search(buffer, start, end):
+        return True
+    header_end = HEADER_END.search(buffer, start, end)
+    return bool(ENCODED_WORD.search(buffer, start, header_end.start() if header_end else end))
+
+def parse_mail_bytes(data, folder_path, entry_id):
+    message = email.message_from_bytes(data, policy=email.policy.default)
+    received_time = None
+    try:
+        received_time = parsedate_to_datetime(str(message['Date']))
+        if received_time.tzinfo is not None:
+            received_time = received_time.astimezone().replace(tzinfo=None)
+    except Exception:
+        pass
+    body = ""
+    part = message.get_body(preferencelist=('plain', 'html'))
+    if part is not None:
+        try:
+            body = part.get_content()
+        except Exception:
+            body = part.get_payload(decode=True).decode('utf-8', errors='replace')
+        if part.get_content_type() == 'text/html':
+            body = re.sub(r'<[^>]+>', ' ', body)
+    message_id = str(message['Message-ID'] or "").strip() or None
+    sender_name, sender = parseaddr(str(message['From'] or ""))
+    return EmailRecord(message_id or entry_id, str(message['Subject'] or ""), sender,
+                       received_time, size=len(data), folder_path=folder_path, body=body,
+                       internet_message_id=message_id, to=str(message['To'] or ""), cc=str(message['Cc'] or ""),
+                       sender_name=sender_name)
+
+def record_matches(record, search_criteria, start=None):
+    if start is not None and record.ReceivedTime is not None and record.ReceivedTime < start:
+        return False
+    criteria = search_criteria.lower()
+    return any(criteria in (value or "").lower()
+               for value in (record.Subject, record.Body, record.SenderEmailAddress, record.SenderName,
+                             record.To, record.CC))
+
+def iter_mbox_records(path, search_criteria, start=None):
+    if os.path.getsize(path) == 0:
+        return
+    term_pattern = re.compile(re.escape(search_criteria.encode('utf-8')), re.IGNORECASE)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for offset, end in iter_mbox_spans(mapped):
+            if not may_contain(mapped, term_pattern, offset, end):
+                continue
+            try:
+                record = parse_mail_bytes(mapped[offset:end], path, f"{path}:{offset}")
+            except Exception as e:
+                log(f"Skipping unparsable message at {path}:{offset}: {str(e)}", 'warning')
+                continue
+            if record_matches(record, search_criteria, start):
+                yield record
+
+def iter_maildir_records(path, search_criteria, start=None):
+    term_pattern = re.compile(re.escape(search_criteria.encode('utf-8')), re.IGNORECASE)
+    # Maildir++ keeps subfolders as dot-directories next to cur/ and new/
+    folders = [path] + [os.path.join(path, name) for name in sorted(os.listdir(path))
+                        if name.startswith('.') and os.path.isdir(os.path.join(path, name))]
+    for folder in folders:
+        for subdir in ('cur', 'new'):
+            directory = os.path.join(folder, subdir)
+            if not os.path.isdir(directory):
+                continue
+            for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+                if not entry.is_file():
+                    continue
+                with open(entry.path, 'rb') as f:
+                    data = f.read()
+                if not may_contain(data, term_pattern):
+                    continue
+                try:
+                    record = parse_mail_bytes(data, folder, entry.path)
+                except Exception as e:
+                    log(f"Skipping unparsable message {entry.path}: {str(e)}", 'warning')
+                    continue
+                if record_matches(record, search_criteria, start):
+                    yield record
+
+IMAP_LIST_PATTERN = re.compile(rb'\((?P<flags>[^)]*)\) (?P<delimiter>"[^"]*"|NIL) (?P<name>.+)')
+IMAP_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+def imap_connect():
+    connection = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT)
+    connection.login(IMAP_USER, IMAP_PASSWORD)
+    return connection
+
+def imap_quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def list_imap_folders(connection):
+    status, lines = connection.list()
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f"LIST failed: {lines}")
+    folders = []
+    for line in lines:
+        match = IMAP_LIST_PATTERN.match(line or b"")
+        if not match or b"\\Noselect" in match.group('flags'):
+            continue
+        folders.append(match.group('name').decode('utf-8').strip('"'))
+    return folders
+
+IMAP_SEARCH_FIELDS = ["SUBJECT", "BODY", "FROM", "TO", "CC"]
+
+def imap_since(start):
+    return ["SINCE", f"{start.day:02d}-{IMAP_MONTHS[start.month - 1]}-{start.year}"]
+
+def imap_search_criteria(search_criteria, start):
+    term = imap_quote(search_criteria)
+    # IMAP OR takes two keys, so the five fields nest as OR a (OR b (OR c (OR d e)))
+    criteria = [IMAP_SEARCH_FIELDS[-1], term]
+    for field in reversed(IMAP_SEARCH_FIELDS[:-1]):
+        criteria = ["OR", field, term] + criteria
+    return imap_since(start) + criteria
+
+def imap_search_uids(connection, folder, search_criteria, start):
+    if search_criteria.isascii():
+        status, data = connection.uid('SEARCH', *imap_search_criteria(search_criteria, start))
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"SEARCH failed in {folder}")
+        return data[0].split() if data and data[0] else []
+    # imaplib sends commands as ASCII and appends at most one literal, at the
+    # end, so a non-ASCII term goes out as a UTF-8 literal once per field
+    uids = set()
+    for field in IMAP_SEARCH_FIELDS:
+        connection.literal = search_criteria.encode('utf-8')
+        status, data = connection.uid('SEARCH', 'CHARSET', 'UTF-8', *imap_since(start), field)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"SEARCH failed in {folder}")
+        uids.update(data[0].split() if data and data[0] else [])
+    return sorted(uids, key=int)
+
+def fetch_imap_folder(connection, folder, search_criteria, start):
+    status, _ = connection.select(imap_quote(folder), readonly=True)
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f"Cannot select {folder}")
+    uids = imap_search_uids(connection, folder, search_criteria, start)
+    records = []
+    for index in range(0, len(uids), IMAP_FETCH_BATCH):
+        # One round trip per batch, and only the header fields and text we use
+        batch = b",".join(uids[index:index + IMAP_FETCH_BATCH]).decode()
+        status, response = connection.uid('FETCH', batch,
+                                          f'(UID BODY.PEEK[HEADER.FIELDS ({IMAP_HEADER_FIELDS})] BODY.PEEK[TEXT])')
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"FETCH failed in {folder}")
+        for uid, header, text in parse_imap_fetch(response):
+            try:
+                record = parse_mail_bytes(header + text, folder, f"{folder}:{uid}")
+            except Exception as e:
+                log(f"Skipping unparsable message {folder}:{uid}: {str(e)}", 'warning')
+                continue
+            records.append(record)
+    records.sort(key=lambda record: record.ReceivedTime or datetime.min, reverse=True)
+    return records
+
+def parse_imap_fetch(response):
+    # imaplib returns (descriptor, literal) tuples; a descriptor starting with a
+    # sequence number opens a new message, and its UID may be in any descriptor
+    message = None
+    for part in response:
+        if not isinstance(part, tuple):
+            if message is not None and message["uid"] is None:
+                match = re.search(rb'UID (\d+)', part or b"")
+                message["uid"] = match.group(1).decode() if match else None
+            continue
+        descriptor, literal = part
+        if re.match(rb'\d+ \(', descriptor):
+            if message is not None:
+                yield message["uid"], message["header"], message["text"]
+            message = {"uid": None, "header": b"", "text": b""}
+        match = re.search(rb'UID (\d+)', descriptor)
+        if match:
+            message["uid"] = match.group(1).decode()
+        if b"HEADER.FIELDS" in descriptor:
+            message["header"] = literal
+        elif b"BODY[TEXT]" in descriptor:
+            message["text"] = literal
+    if message is not None:
+        yield message["uid"], message["header"], message["text"]
+
+def iter_imap_records(search_criteria, start, connect=imap_connect, connections=IMAP_CONNECTIONS):
+    connection = connect()
+    try:
+        folders = IMAP_FOLDERS or list_imap_folders(connection)
+    finally:
+        connection.logout()
+    tasks = queue.Queue()
+    for index, folder in enumerate(folders):
+        tasks.put((index, folder))
+    results = {}
+
+    def worker():
+        # imaplib connections are not thread-safe, so every worker has its own
+        try:
+            connection = connect()
+        except Exception as e:
+            log(f"IMAP connection failed: {str(e)}", 'error')
+            return
+        try:
+            while True:
+                try:
+                    index, folder = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[index] = fetch_imap_folder(connection, folder, search_criteria, start)
+                    log(f"Found {len(results[index])} emails in {folder}")
+                except Exception as e:
+                    log(f"Error searching IMAP folder {folder}: {str(e)}", 'warning')
+        finally:
+            try:
+                connection.logout()
+            except Exception:
+                pass
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(connections, len(folders))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    yield from heapq.merge(*(results.get(index, []) for index in range(len(folders))),
+                           key=lambda record: record.ReceivedTime or datetime.min, reverse=True)
+
+EWS_ACCOUNTS = {}
+
+def ews_account(server=None, user=None, password=None, address=None):
+    # Account setup negotiates with the server, so keep one per mailbox for the
+    # whole run; exchangelib pools its HTTP connections per account protocol
+    server, user = server or EWS_SERVER, user or EWS_USER
+    address = address or EWS_ADDRESS
+    key = (server, user, address)
+    if key not in EWS_ACCOUNTS:
+        if exchangelib is None:
+            raise ImportError("exchangelib is required for the EWS mail source")
+        BaseProtocol.SESSION_POOLSIZE = EWS_POOL_SIZE
+        credentials = exchangelib.Credentials(user, password or EWS_PASSWORD)
+        config = exchangelib.Configuration(server=server, credentials=credentials)
+        EWS_ACCOUNTS[key] = exchangelib.Account(address, config=config, autodiscover=False,
+                                                access_type=exchangelib.DELEGATE)
+        log(f"Connected to Exchange mailbox {address}")
+    return EWS_ACCOUNTS[key]
+
+def ews_record(item, folder_name):
+    received_time = item.datetime_received
+    if received_time is not None:
+        received_time = to_naive_datetime(received_time.astimezone(exchangelib.EWSTimeZone.localzone()))
+    sender = item.sender.email_address if item.sender is not None else ""
+    return EmailRecord(item.id, item.subject or "", sender or "", received_time,
+                       conversation_id=item.conversation_id.id if item.conversation_id is not None else None,
+                       size=item.size or 0, folder_path=folder_name, body=item.text_body or "",
+                       internet_message_id=item.message_id,
+                       to="; ".join(r.email_address or "" for r in item.to_recipients or []),
+                       cc="; ".join(r.email_address or "" for r in item.cc_recipients or []))
+
+def iter_ews_records(search_criteria, start, account=None):
+    account = account or ews_account()
+    # A plain astimezone() zone has no IANA name, which exchangelib rejects on
+    # non-UTC hosts; its own localzone() maps the host zone properly
+    since = exchangelib.EWSDateTime.from_datetime(start.replace(tzinfo=exchangelib.EWSTimeZone.localzone()))
+    matches = exchangelib.Q(subject__icontains=search_criteria) | exchangelib.Q(body__icontains=search_criteria)
+    roots = [account.inbox, account.sent, account.trash, account.outbox, account.drafts]
+    results = []
+    for root in roots:
+        try:
+            # One FindItem over the whole tree instead of a query per subfolder
+            folders = [root, *root.walk()]
+            folder_names = {folder.id: folder.name for folder in folders}
+            collection = exchangelib.FolderCollection(account=account, folders=folders)
+            # Server-side restriction and projection: only matching items come
+            # back, and GetItem only asks for the fields the analysis reads
+            query = (collection.filter(matches, datetime_received__gte=since)
+                     .only(*EWS_FIELDS).order_by('-datetime_received'))
+            query.page_size = EWS_PAGE_SIZE
+            query.chunk_size = EWS_CHUNK_SIZE
+            records = [ews_record(item, folder_names.get(getattr(item.parent_folder_id, "id", None), root.name))
+                       for item in query]
+            log(f"Found {len(records)} emails in {root.name} and its subfolders")
+            results.append(records)
+        except Exception as e:
+            log(f"Error searching EWS folder {getattr(root, 'name', root)}: {str(e)}", 'warning')
+    yield from heapq.merge(*results, key=lambda record: record.ReceivedTime or datetime.min, reverse=True)
+
+def iter_mail_source(source, path, search_criteria, days_back=30):
+    location = {"imap": IMAP_HOST, "ews": EWS_SERVER}.get(source, path)
+    log(f"Reading emails related to '{search_criteria}' from {source} {location}...")
+    start = datetime.now() - timedelta(days=days_back)
+    start = datetime(start.year, start.month, start.day)
+    if source == "mbox":
+        records = iter_mbox_records(path, search_criteria, start)
+    elif source == "maildir":
+        records = iter_maildir_records(path, search_criteria, start)
+    elif source == "imap":
+        records = iter_imap_records(search_criteria, start)
+    elif source == "ews":
+        records = iter_ews_records(search_criteria, start)
+    else:
+        raise ValueError(f"Unknown mail source: {source}")
+    found = 0
+    for record in records:
+        yield record
+        found += 1
+    log(f"Total emails found in {location}: {found}")
+
+def message_identity(message):
+    # InternetMessageID is shared by every copy of a message; without one, fall
+    # back to a hash of the subject and whitespace-normalized body
+    message_id = getattr(message, "InternetMessageID", None)
+    if not message_id and not isinstance(message, EmailRecord):
+        try:
+            message_id = message.PropertyAccessor.GetProperty(PR_INTERNET_MESSAGE_ID)
+        except Exception:
+            message_id = None
+    if message_id:
+        return f"id:{message_id.strip()}"
+    content = f"{(message.Subject or '').strip().lower()}\n{' '.join(normalize_body(message.Body).split())}"
+    return f"body:{hashlib.sha1(content.encode('utf-8')).hexdigest()}"
+
+def message_folder(message):
+    if isinstance(message, EmailRecord):
+        return message.FolderPath
+    try:
+        return message.Parent.FolderPath
+    except Exception:
+        return None
+
+def deduplicate_emails(messages, stats=None):
+    # Folders are searched Inbox and Sent Items first, so the first copy seen is
+    # kept and later copies (Deleted Items, filed duplicates) are dropped
+    if stats is None:
+        stats = {}
+    stats.update(kept=0, duplicates=0, bytes_saved=0, tokens_saved=0, seen_in={})
+    for message in messages:
+        try:
+            key = message_identity(message)
+        except Exception as e:
+            log(f"Could not identify message for de-duplication: {str(e)}", 'warning')
+            yield message
+            continue
+        folder = message_folder(message)
+        if key in stats["seen_in"]:
+            if folder not in stats["seen_in"][key]:
+                stats["seen_in"][key].append(folder)
+            # Size is already in the item's metadata; reading Body would load a
+            # lazy record's body from Outlook only to throw it away
+            size = message.Size or 0
+            stats["duplicates"] += 1
+            stats["bytes_saved"] += size
+            stats["tokens_saved"] += size // CHARS_PER_TOKEN
+            continue
+        stats["seen_in"][key] = [folder]
+        stats["kept"] += 1
+        yield message
+    log(f"De-duplication kept {stats['kept']} emails and dropped {stats['duplicates']} copies "
+        f"(~{stats['bytes_saved']} bytes, ~{stats['tokens_saved']} tokens saved)")
+    for key, folders in stats["seen_in"].items():
+        if len(folders) > 1:
+            log(f"{key} was found in {', '.join(str(folder) for folder in folders)}")
+
+def duplicate_folders(stats):
+    # Message key -> every folder it was found in, for emails kept from several copies
+    return {key: folders for key, folders in stats.get("seen_in", {}).items() if len(folders) > 1}
+
+class AddressResolver:
+    """Resolves Exchange DNs and display names to SMTP addresses, once.
+
+    Results are kept in a JSON cache so later runs skip the COM lookups too.
+    """
+
+    def __init__(self, session, cache_path=ADDRESS_CACHE):
+        self.session = session
+        self.cache_path = cache_path
+        self.cache = {}
+        self.dirty = False
+        self._current_user = None
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self.cache = json.load(f)
+            except Exception as e:
+                log(f"Ignoring unreadable address cache {cache_path}: {str(e)}", 'warning')
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f, indent=2, sort_keys=True)
+            self.dirty = False
+        except Exception as e:
+            log(f"Error saving address cache {self.cache_path}: {str(e)}", 'warning')
+
+    def remember(self, key, address):
+        self.cache[key] = address
+        self.dirty = True
+        return address
+
+    def current_user(self):
+        if self._current_user is None:
+            if self.session is None:
+                self._current_user = MAILBOX_ADDRESS.lower()
+                return self._current_user
+            current_user = self.session.CurrentUser
+            try:
+                self._current_user = current_user.AddressEntry.GetExchangeUser().PrimarySmtpAddress.lower()
+            except Exception:
+                self._current_user = self.resolve_name(current_user.Address).lower()
+        return self._current_user
+
+    def recipient_address(self, recipient):
+        entry = recipient.AddressEntry
+        exchange_user = entry.GetExchangeUser()
+        return exchange_user.PrimarySmtpAddress if exchange_user else entry.Address
+
+    def resolve_name(self, name):
+        if not name or "@" in name or self.session is None:
+            return name
+        if name in self.cache:
+            return self.cache[name]
+        # Failures are not cached: a name the address book could not resolve
+        # today (offline, ambiguous) may well resolve on the next run
+        try:
+            recipient = self.session.CreateRecipient(name)
+            if not recipient.Resolve():
+                return name
+            return self.remember(name, self.recipient_address(recipient))
+        except Exception as e:
+            log(f"Could not resolve {name}: {str(e)}", 'warning')
+            return name
+
+    def resolve_names(self, names):
+        # Every unknown name goes on one scratch item and a single ResolveAll
+        # looks them all up; everything else is answered from the cache
+        names = list(names)
+        unknown = sorted({name for name in names if name and "@" not in name and name not in self.cache})
+        if self.session is None:
+            unknown = []
+        if unknown:
+            log(f"Resolving {len(unknown)} new addresses...")
+            try:
+                recipients = self.session.Application.CreateItem(OL_MAIL_ITEM).Recipients
+                added = [(name, recipients.Add(name)) for name in unknown]
+                recipients.ResolveAll()
+            except Exception as e:
+                log(f"Batch resolution failed, resolving names one at a time: {str(e)}", 'warning')
+                added = []
+                for name in unknown:
+                    self.resolve_name(name)
+            for name, recipient in added:
+                try:
+                    if recipient.Resolved:
+                        self.remember(name, self.recipient_address(recipient))
+                except Exception as e:
+                    log(f"Could not resolve {name}: {str(e)}", 'warning')
+        return {name: self.cache.get(name, name) if name in unknown else self.resolve_name(name)
+                for name in names if name}
+
+    def sender_address(self, message):
+        address = message.SenderEmailAddress
+        if not address or "@" in address:
+            return address
+        if address in self.cache:
+            return self.cache[address]
+        if isinstance(message, EmailRecord):
+            return self.resolve_name(address)
+        try:
+            smtp = message.Sender.GetExchangeUser().PrimarySmtpAddress
+        except Exception:
+            try:
+                smtp = message.PropertyAccessor.GetProperty(PR_SENDER_SMTP_ADDRESS)
+            except Exception:
+                return self.resolve_name(address)
+        return self.remember(address, smtp)
+
+def split_recipients(display):
+    return [name.strip() for name in (display or "").split(";") if name.strip()]
+
+def analyze_person_emails(messages, resolver=None):
     try:
         log("Analyzing emails for person-specific information...")
         
@@ -150,6 +1728,8 @@ def analyze_person_emails(messages):
         
         for message in messages:
             try:
+                if resolver is None:
+                    resolver = AddressResolver(message.Session)
                 subject = message.Subject
                 body = message.Body
                 # Convert received time to naive datetime for comparison
@@ -193,10 +1773,12 @@ def analyze_person_emails(messages):
                             tasks_analysis['assigned_to_me'].append(task_info)
                 
                 # Add to recent interactions
+                sender = (resolver.sender_address(message) or "").lower()
                 interaction = {
                     'date': date,
                     'subject': subject,
-                    'type': 'sent' if message.SenderEmailAddress == message.Session.CurrentUser.Address else 'received'
+                    'type': 'sent' if sender == resolver.current_user() else 'received',
+                    'participants': split_recipients(message.To) + split_recipients(message.CC)
                 }
                 tasks_analysis['recent_interactions'].append(interaction)
                 
@@ -204,6 +1786,14 @@ def analyze_person_emails(messages):
                 log(f"Error processing message: {str(e)}", 'warning')
                 continue
         
+        # Resolve all recipients in one batch rather than per message
+        if resolver is not None:
+            addresses = resolver.resolve_names(name for interaction in tasks_analysis['recent_interactions']
+                                               for name in interaction['participants'])
+            for interaction in tasks_analysis['recent_interactions']:
+                interaction['participants'] = [addresses.get(name, name) for name in interaction['participants']]
+            resolver.save()
+        
         # Sort all lists by date
         for key in tasks_analysis:
             if key != 'action_items':
@@ -221,35 +1811,231 @@ def analyze_person_emails(messages):
         log(f"Error analyzing person emails: {str(e)}", 'error')
         raise
 
-def get_email_content(message):
+URLDEFENSE_LINK = re.compile(r'https?://urldefense(?:\.proofpoint)?\.com/(?:v3/__https?:/+|v2/url\?u=https?-3A__)'
+                             r'([A-Za-z0-9.-]+)[^\s<>\]]*')
+EXTERNAL_BANNER = re.compile(r'^[ \t]*\[EXTERNAL EMAIL\][ \t]*\n?', re.IGNORECASE | re.MULTILINE)
+
+def line_template(line):
+    return " ".join(line.lower().split())
+
+class BoilerplateFilter:
+    """Learns recurring signature/disclaimer lines and strips them from bodies.
+
+    Only the part of a body above its quoted history is learned from, so text
+    that recurs because replies quote it is never mistaken for boilerplate.
+    A template counts the distinct emails whose signature block (or trailing
+    paragraph) contained it, and the distinct senders who wrote it anywhere;
+    the cache keeps the message_identity keys already learned from, so
+    re-exporting the same email does not count it again. Lines carrying ticket
+    numbers, server names, phone numbers or addresses are never stripped.
+    """
+
+    def __init__(self, cache_path=BOILERPLATE_CACHE):
+        self.cache_path = cache_path
+        self.counts = {}
+        self.senders = {}
+        self.seen = {}
+        self.dirty = False
+        self.chars_in = 0
+        self.chars_out = 0
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+                if "senders" in cache:
+                    self.counts = cache["counts"]
+                    self.senders = cache["senders"]
+                    self.seen = dict.fromkeys(cache.get("seen", []))
+                else:
+                    # Older caches learned every line of an email's own text
+                    log(f"Discarding boilerplate cache {cache_path} from an older version", 'warning')
+            except Exception as e:
+                log(f"Ignoring unreadable boilerplate cache {cache_path}: {str(e)}", 'warning')
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            # Keep the most frequent lines and the most recent emails; one-off
+            # lines and old message keys would grow the cache forever
+            counts = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+            self.counts = dict(counts[:BOILERPLATE_MAX_TEMPLATES])
+            senders = sorted(self.senders.items(), key=lambda item: len(item[1]), reverse=True)
+            self.senders = dict(senders[:BOILERPLATE_MAX_TEMPLATES])
+            self.seen = dict.fromkeys(list(self.seen)[-BOILERPLATE_MAX_SEEN:])
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump({"counts": self.counts, "senders": self.senders, "seen": list(self.seen)}, f, indent=2)
+            self.dirty = False
+        except Exception as e:
+            log(f"Error saving boilerplate cache {self.cache_path}: {str(e)}", 'warning')
+
+    def is_protected(self, line):
+        return bool(TICKET_PATTERN.search(line) or any(CHAIN_TEXT_PATTERNS[name].search(line)
+                                                       for name in ("server_list", "phones", "emails")))
+
+    def learn(self, body, key, sender):
+        if key in self.seen:
+            return
+        self.seen[key] = None
+        self.dirty = True
+        own = []
+        for line in body.split("\n"):
+            if QUOTE_START.match(line):
+                break
+            own.append(line)
+        # The signature block runs from its sign-off to the quoted history; an
+        # email without one contributes its trailing paragraph instead
+        start = next((index for index, line in enumerate(own) if SIGNATURE_START.match(line)), None)
+        if start is None:
+            blanks = [index for index, line in enumerate(own) if not line.strip() and index < len(own) - 1]
+            start = blanks[-1] + 1 if blanks else len(own)
+        sender = (sender or "").lower()
+        signature = set()
+        for index, line in enumerate(own):
+            template = line_template(line)
+            if len(template) < BOILERPLATE_MIN_LENGTH or self.is_protected(line):
+                continue
+            if index >= start:
+                signature.add(template)
+            if sender:
+                senders = self.senders.setdefault(template, [])
+                if sender not in senders and len(senders) < BOILERPLATE_MIN_SENDERS:
+                    senders.append(sender)
+        for template in signature:
+            self.counts[template] = self.counts.get(template, 0) + 1
+
+    def is_boilerplate(self, line):
+        template = line_template(line)
+        if (self.counts.get(template, 0) < BOILERPLATE_MIN_COUNT
+                and len(self.senders.get(template, ())) < BOILERPLATE_MIN_SENDERS):
+            return False
+        return not self.is_protected(line)
+
+    def clean(self, body, key, sender):
+        self.chars_in += len(body)
+        body = URLDEFENSE_LINK.sub(r'\1', body.replace("\r\n", "\n").replace("\r", "\n"))
+        body = EXTERNAL_BANNER.sub("", body)
+        self.learn(body, key, sender)
+        lines = [" ".join(line.split()) for line in body.split("\n") if not self.is_boilerplate(line)]
+        body = re.sub(r'\n{3,}', "\n\n", "\n".join(lines)).strip()
+        self.chars_out += len(body)
+        return body
+
+def get_email_content(message, resolver=None, boilerplate=None):
     try:
         subject = message.Subject
-        sender = message.SenderEmailAddress
+        sender = resolver.sender_address(message) if resolver else message.SenderEmailAddress
         body = message.Body
+        if boilerplate and body:
+            body = boilerplate.clean(body, message_identity(message), sender)
         received_time = message.ReceivedTime
         return subject, sender, body, received_time
     except Exception as e:
         log(f"Error extracting email content: {str(e)}", 'error')
         return None, None, None, None
 
-def export_to_text(messages, output_file):
+def export_to_text(messages, output_file, resolver=None, boilerplate=None):
     try:
         log(f"Exporting emails to {output_file}...")
+        exported = 0
         with open(output_file, 'w', encoding='utf-8') as f:
             for message in messages:
-                subject, sender, body, received_time = get_email_content(message)
+                subject, sender, body, received_time = get_email_content(message, resolver, boilerplate)
                 if subject and sender and body and received_time:
                     f.write(f"Subject: {subject}\n")
                     f.write(f"From: {sender}\n")
                     f.write(f"Received: {received_time}\n")
                     f.write(f"Body:\n{body}\n")
                     f.write("-" * 80 + "\n\n")
-        log(f"Emails exported successfully to {output_file}")
+                    exported += 1
+        if resolver:
+            resolver.save()
+        if boilerplate:
+            boilerplate.save()
+        log(f"{exported} emails exported successfully to {output_file}")
         return output_file
     except Exception as e:
         log(f"Error exporting emails to text file: {str(e)}", 'error')
         raise
 
+def chain_codec(file_path):
+    # (compress, decompress) for one frame, or None for an uncompressed chain
+    if file_path.endswith(".gz"):
+        return (lambda data: gzip.compress(data, mtime=0)), gzip.decompress
+    if file_path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("zstandard is required for .zst chain archives")
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+    return None
+
+def export_to_jsonl(messages, output_file, resolver=None, boilerplate=None):
+    try:
+        log(f"Exporting emails to {output_file}...")
+        codec = chain_codec(output_file)
+        index = {}
+        offset = 0
+        with open(output_file, 'wb') as f:
+            for message in messages:
+                subject, sender, body, received_time = get_email_content(message, resolver, boilerplate)
+                if subject and sender and body and received_time:
+                    message_id = message_identity(message)
+                    if message_id in index:
+                        message_id = f"{message_id}#{len(index)}"
+                    record = {"id": message_id, "subject": subject, "from": sender,
+                              "received": str(received_time), "body": body}
+                    line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+                    if codec:
+                        # Every email is a complete frame, so it decompresses on its own
+                        line = codec[0](line)
+                    f.write(line)
+                    index[message_id] = {"offset": offset, "length": len(line), "received": record["received"]}
+                    offset += len(line)
+        with open(output_file + CHAIN_INDEX_SUFFIX, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2)
+        if resolver:
+            resolver.save()
+        if boilerplate:
+            boilerplate.save()
+        log(f"{len(index)} emails exported successfully to {output_file}")
+        return output_file
+    except Exception as e:
+        log(f"Error exporting emails to JSONL file: {str(e)}", 'error')
+        raise
+
+def load_chain_index(file_path):
+    with open(file_path + CHAIN_INDEX_SUFFIX, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def read_chain_record(file_path, message_id, index=None):
+    # Seeks straight to one email instead of reading the chain up to it
+    entry = (index or load_chain_index(file_path))[message_id]
+    codec = chain_codec(file_path)
+    with open(file_path, 'rb') as f:
+        f.seek(entry["offset"])
+        data = f.read(entry["length"])
+    return json.loads(codec[1](data) if codec else data)
+
+def iter_chain_records(file_path, first=0, last=None, oldest_first=False):
+    # Plain chains stream line by line; archives (or a slice of any chain, e.g.
+    # one parallel reader's share, or the chain in date order) are read frame by
+    # frame through the index
+    codec = chain_codec(file_path)
+    if codec is None and first == 0 and last is None and not oldest_first:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    entries = list(load_chain_index(file_path).values())
+    if oldest_first:
+        entries.sort(key=lambda entry: entry["received"])
+    entries = entries[first:last]
+    with open(file_path, 'rb') as f:
+        for entry in entries:
+            f.seek(entry["offset"])
+            data = f.read(entry["length"])
+            yield json.loads(codec[1](data) if codec else data)
+
 def simple_summarize(text, num_sentences=3):
     sentences = sent_tokenize(text)
     words = word_tokenize(text.lower())
@@ -269,6 +2055,39 @@ def simple_summarize(text, num_sentences=3):
     summary = ' '.join(summary_sentences)
     return summary
 
+def summarize_stream(iter_texts, num_sentences=3):
+    # Same scoring as simple_summarize, but over two streaming passes so only one
+    # email and the current top sentences are held in memory
+    stop_words = set(stopwords.words('english'))
+    word_frequencies = FreqDist()
+    # Repeated sentences (quoted replies) score once per occurrence, as in simple_summarize
+    sentence_counts = defaultdict(int)
+    for text in iter_texts():
+        word_frequencies.update(word for word in word_tokenize(text.lower()) if word not in stop_words)
+        for sentence in sent_tokenize(text):
+            sentence_counts[hash(sentence)] += 1
+
+    top_sentences = []
+    candidates = set()
+    order = 0
+    for text in iter_texts():
+        for sentence in sent_tokenize(text):
+            if sentence in candidates:
+                continue
+            score = sum(word_frequencies[word] for word in word_tokenize(sentence.lower()) if word in word_frequencies)
+            score *= sentence_counts[hash(sentence)]
+            if not score:
+                continue
+            order += 1
+            entry = (score, -order, sentence)
+            if len(top_sentences) < num_sentences:
+                heapq.heappush(top_sentences, entry)
+                candidates.add(sentence)
+            elif entry > top_sentences[0]:
+                candidates.discard(heapq.heapreplace(top_sentences, entry)[2])
+                candidates.add(sentence)
+    return ' '.join(sentence for _, _, sentence in sorted(top_sentences, reverse=True))
+
 def extract_teams_and_responsibilities(content):
     teams = defaultdict(list)
     responsibilities = defaultdict(list)
@@ -300,17 +2119,252 @@ def extract_key_details(content):
     
     return dict(key_details)
 
+CHAIN_HEADER_LINE = re.compile(r'^(Subject|From|Received):\s?(.*)$')
+# Where the quoted history of a reply starts: "On ... wrote:", an Outlook
+# "From:" header block, an "Original Message" banner or ">" quoting
+QUOTE_START = re.compile(r'^\s*(?:On\s.+\swrote:\s*$|-+\s*Original Message\s*-+|From:\s|>)', re.IGNORECASE)
+QUOTE_ATTRIBUTION_START = re.compile(r'^\s*On\s.+', re.IGNORECASE)
+SIGNATURE_START = re.compile(r'^\s*(?:--\s*|(?:Thanks|Thank you|Many thanks|Regards|Best regards|Kind regards|'
+                             r'Warm regards|Thanks (?:and|&) regards|Best|Cheers)[,.!]?\s*)$', re.IGNORECASE)
+
+def iter_chain_lines(file_path, start=0, end=None):
+    # (start offset, end offset, text) per line; offsets are bytes into the file
+    offset = start
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            if end is not None and offset >= end:
+                break
+            yield offset, offset + len(line), as_text(line).rstrip("\n")
+            offset += len(line)
+
+def parse_chain_lines(lines, headers=None):
+    """Single pass over (start, end, text) lines of an exported chain.
+
+    Yields one record per email with its export headers, own body, signature
+    block and quoted history; each part keeps the (start, end) offsets of the
+    lines it was built from. Given headers, the lines are the body of a single
+    email: parsing starts in the body and separator lines are plain text.
+    """
+    separator = "-" * 80
+
+    def new_record():
+        return {"offset": None, "end": None, "headers": {},
+                "body": [], "signature": [], "quoted": [],
+                "spans": {"body": None, "signature": None, "quoted": None}}
+
+    def add(part, start, end, text):
+        record[part].append(text)
+        span = record["spans"][part]
+        record["spans"][part] = (span[0] if span else start, end)
+
+    def finish():
+        for part in ("body", "signature", "quoted"):
+            record[part] = "\n".join(record[part]).strip()
+        return record
+
+    record = new_record()
+    state = "headers"
+    if headers is not None:
+        record["headers"], record["offset"], record["end"] = dict(headers), 0, 0
+        state = "body"
+    pending = None  # an "On ..." line that may be the first half of a wrapped attribution
+    for start, end, text in lines:
+        if headers is None and text.strip() == separator:
+            if pending:
+                add(state, *pending)
+            if record["offset"] is not None:
+                yield finish()
+            record, state, pending = new_record(), "headers", None
+            continue
+        if text.strip():
+            if record["offset"] is None:
+                record["offset"] = start
+            record["end"] = end
+        if state == "headers":
+            match = CHAIN_HEADER_LINE.match(text)
+            if text.strip() == "Body:":
+                state = "body"
+            elif match:
+                record["headers"][match.group(1).lower()] = match.group(2).strip()
+            continue
+        if pending:
+            held, pending = pending, None
+            if text.rstrip().endswith("wrote:"):
+                state = "quoted"
+                add(state, *held)
+                add(state, start, end, text)
+                continue
+            add(state, *held)
+        if state != "quoted":
+            if QUOTE_START.match(text):
+                state = "quoted"
+            elif QUOTE_ATTRIBUTION_START.match(text):
+                pending = (start, end, text)
+                continue
+            elif state == "body" and SIGNATURE_START.match(text):
+                state = "signature"
+        add(state, start, end, text)
+    if pending:
+        add(state, *pending)
+    if record["offset"] is not None:
+        yield finish()
+
+def parse_chain_record(record):
+    # JSONL records already carry their headers, so only the body is parsed and
+    # its offsets are relative to the body rather than to the file
+    offset = 0
+    lines = []
+    for line in record["body"].split("\n"):
+        size = len(line.encode('utf-8')) + 1
+        lines.append((offset, offset + size, line))
+        offset += size
+    headers = {"subject": record["subject"], "from": record["from"], "received": record["received"]}
+    for parsed in parse_chain_lines(lines, headers):
+        parsed["id"] = record["id"]
+        yield parsed
+
+def parse_chain(file_path, oldest_first=False):
+    # Separator lines only mark email boundaries in .txt chains. Oldest-first
+    # order comes from the index dates of a JSONL chain; a text chain is walked
+    # once for each email's date and offsets, then each email is re-read in
+    # date order, so only one email is held in memory at a time.
+    if file_path.endswith(tuple(CHAIN_EXTENSIONS.values())):
+        for record in iter_chain_records(file_path, oldest_first=oldest_first):
+            yield from parse_chain_record(record)
+    elif oldest_first:
+        spans = sorted((record["headers"].get("received", ""), record["offset"], record["end"])
+                       for record in parse_chain(file_path))
+        for _, start, end in spans:
+            yield from parse_chain_lines(iter_chain_lines(file_path, start, end))
+    else:
+        yield from parse_chain_lines(iter_chain_lines(file_path))
+
+QUOTE_MARKER = re.compile(r'^[ \t]*(?:>[ \t]*)*', re.MULTILINE)
+PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+
+def iter_shingles(words, size=SHINGLE_SIZE):
+    # Rabin-Karp rolling hash over word hashes: each step removes the word
+    # leaving the window and adds the one entering it
+    if len(words) <= size:
+        if words:
+            yield hash(tuple(words))
+        return
+    word_hashes = [hash(word) % SHINGLE_MODULUS for word in words]
+    high = pow(SHINGLE_BASE, size - 1, SHINGLE_MODULUS)
+    value = 0
+    for word_hash in word_hashes[:size]:
+        value = (value * SHINGLE_BASE + word_hash) % SHINGLE_MODULUS
+    yield value
+    for outgoing, incoming in zip(word_hashes, word_hashes[size:]):
+        value = ((value - outgoing * high) * SHINGLE_BASE + incoming) % SHINGLE_MODULUS
+        yield value
+
+def split_paragraphs(text):
+    # ">" markers and indentation are stripped so a quoted copy of a paragraph
+    # shingles the same as the original
+    text = QUOTE_MARKER.sub("", text)
+    return [paragraph.strip() for paragraph in PARAGRAPH_BREAK.split(text) if paragraph.strip()]
+
+def chain_text(headers, parts):
+    # Same layout export_to_text writes, so the analyzers see identical content
+    return (f"Subject: {headers.get('subject', '')}\nFrom: {headers.get('from', '')}\n"
+            f"Received: {headers.get('received', '')}\nBody:\n" + "\n\n".join(part for part in parts if part))
+
+def deduplicate_chain(records, stats=None):
+    # Records must arrive oldest first (parse_chain(..., oldest_first=True)), so
+    # each paragraph is kept where it was first written and the quoted copies in
+    # later replies are the ones dropped
+    if stats is None:
+        stats = {}
+    stats.update(paragraphs=0, dropped=0, chars_in=0, chars_out=0, ratio=1.0)
+    seen = set()
+    for record in records:
+        kept = []
+        for part in ("body", "signature", "quoted"):
+            for paragraph in split_paragraphs(record[part]):
+                stats["paragraphs"] += 1
+                stats["chars_in"] += len(paragraph)
+                shingles = set(iter_shingles(re.findall(r'\w+', paragraph.lower())))
+                if shingles and len(shingles & seen) >= SHINGLE_OVERLAP * len(shingles):
+                    stats["dropped"] += 1
+                    continue
+                seen.update(shingles)
+                kept.append(paragraph)
+                stats["chars_out"] += len(paragraph)
+        record["text"] = chain_text(record["headers"], kept)
+        yield record
+    stats["ratio"] = stats["chars_in"] / stats["chars_out"] if stats["chars_out"] else 1.0
+    log(f"Quoted-reply de-duplication kept {stats['chars_out']} of {stats['chars_in']} characters "
+        f"({stats['paragraphs'] - stats['dropped']} of {stats['paragraphs']} paragraphs, "
+        f"{stats['ratio']:.1f}x reduction)")
+
+# Compiled once as str patterns (JSONL chains) and as byte patterns that run
+# directly on a memory-mapped text chain; only the matches get decoded. Byte
+# patterns see raw \r\n / \r line endings, hence the explicit newline forms.
+CHAIN_PATTERNS = {
+    "subject": (r'Subject: (.*)', 0),
+    "server_list": (r'\b(?:azw|srv|server-)[a-zA-Z0-9-]+\b', re.IGNORECASE),
+    "change_numbers": (r'\bCHG\d+\b', 0),
+    "related_tasks": (r'\b(?:RITM|CTASK)\d+\b', 0),
+    "advisory": (r'(?:Advisory|Note|Important):\s*((?:(?!(?:\r\n|\r(?!\n)|\n){2}).)+)', re.IGNORECASE | re.DOTALL),
+    "incidents": (r'\bINC\d+\b', 0),
+    "emails": (r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', 0),
+    "phones": (r'\b(?:\+\d{1,2}\s)?\(?\d{3}\)?[\s.-]\d{3}[\s.-]\d{4}\b', 0),
+    "status": (r'([^.]*status[^.]*\.)', re.IGNORECASE),
+}
+CHAIN_TEXT_PATTERNS = {name: re.compile(pattern, flags) for name, (pattern, flags) in CHAIN_PATTERNS.items()}
+CHAIN_BYTE_PATTERNS = {name: re.compile(pattern.encode(), flags) for name, (pattern, flags) in CHAIN_PATTERNS.items()}
+
+def as_text(value):
+    if isinstance(value, str):
+        return value
+    # Same newline translation as reading the file in text mode
+    return value.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+def scan_chain_email(consolidated_info, buffer, start, end, patterns):
+    # Every regex runs on the buffer between start and end (a str email, or a
+    # span of a memory-mapped chain); only the matched text is decoded
+    def findall(name):
+        return [as_text(value) for value in patterns[name].findall(buffer, start, end)]
+
+    def first(name):
+        match = patterns[name].search(buffer, start, end)
+        return as_text(match.group(1)).strip() if match else None
+
+    if not consolidated_info["subject"]:
+        consolidated_info["subject"] = first("subject") or ""
+    consolidated_info["server_list"].update(findall("server_list"))
+    consolidated_info["change_numbers"].update(findall("change_numbers"))
+    consolidated_info["related_tasks"].update(findall("related_tasks"))
+    if not consolidated_info["advisory"]:
+        consolidated_info["advisory"] = first("advisory") or ""
+    consolidated_info["incidents"].update(findall("incidents"))
+    consolidated_info["contact_details"].update(findall("emails"))
+    consolidated_info["contact_details"].update(findall("phones"))
+    status_sentences = findall("status")
+    if status_sentences:
+        consolidated_info["current_status"] = status_sentences[-1].strip()
+
+    # Team and sentence extraction need the decoded email itself
+    content = as_text(buffer[start:end])
+    teams, responsibilities = extract_teams_and_responsibilities(content)
+    for team, members in teams.items():
+        consolidated_info["teams_involved"][team].extend(members)
+    for team, tasks in responsibilities.items():
+        consolidated_info["tasks_and_responsibilities"][team].extend(tasks)
+    for keyword, sentences in extract_key_details(content).items():
+        consolidated_info["key_details"][keyword].extend(sentences)
+
 def analyze_email_chain(file_path):
     try:
         log(f"Analyzing email chain from {file_path}...")
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
 
         consolidated_info = {
             "subject": "",
             "summary": "",
-            "teams_involved": {},
-            "tasks_and_responsibilities": {},
+            "teams_involved": defaultdict(list),
+            "tasks_and_responsibilities": defaultdict(list),
             "server_list": set(),
             "change_numbers": set(),
             "related_tasks": set(),
@@ -318,51 +2372,53 @@ def analyze_email_chain(file_path):
             "incidents": set(),
             "contact_details": set(),
             "current_status": "",
-            "key_details": {},
+            "key_details": defaultdict(list),
         }
 
-        # Extract subject
-        subject_match = re.search(r'Subject: (.*)', content)
-        if subject_match:
-            consolidated_info["subject"] = subject_match.group(1).strip()
-
-        # Generate summary
-        consolidated_info["summary"] = simple_summarize(content)
-
-        # Extract teams and responsibilities
-        consolidated_info["teams_involved"], consolidated_info["tasks_and_responsibilities"] = extract_teams_and_responsibilities(content)
-
-        # Extract server list
-        consolidated_info["server_list"].update(re.findall(r'\b(?:azw|srv|server-)[a-zA-Z0-9-]+\b', content, re.IGNORECASE))
+        if CHAIN_DEDUP:
+            # The report subject is the first email's in file order (the newest),
+            # even though de-duplication walks the chain oldest first
+            first = next(parse_chain(file_path), None)
+            consolidated_info["subject"] = first["headers"].get("subject", "") if first else ""
+            passes = 0
 
-        # Extract change numbers and related tasks
-        consolidated_info["change_numbers"].update(re.findall(r'\bCHG\d+\b', content))
-        consolidated_info["related_tasks"].update(re.findall(r'\b(?:RITM|CTASK)\d+\b', content))
+            def iter_texts():
+                # Each summary pass streams the chain again; the extraction runs
+                # alongside the first one instead of needing a third pass
+                nonlocal passes
+                passes += 1
+                scan = passes == 1
+                for record in deduplicate_chain(parse_chain(file_path, oldest_first=True)):
+                    content = record["text"]
+                    if scan:
+                        scan_chain_email(consolidated_info, content, 0, len(content), CHAIN_TEXT_PATTERNS)
+                    yield content
 
-        # Extract advisory
-        advisory_match = re.search(r'(?:Advisory|Note|Important):\s*((?:(?!\n\n).)+)', content, re.IGNORECASE | re.DOTALL)
-        if advisory_match:
-            consolidated_info["advisory"] = advisory_match.group(1).strip()
+            consolidated_info["summary"] = summarize_stream(iter_texts)
+        elif file_path.endswith(tuple(CHAIN_EXTENSIONS.values())):
+            def iter_texts():
+                return (chain_text(record["headers"], (record["body"], record["signature"], record["quoted"]))
+                        for record in parse_chain(file_path))
 
-        # Extract incidents
-        consolidated_info["incidents"].update(re.findall(r'\bINC\d+\b', content))
-
-        # Extract contact details
-        consolidated_info["contact_details"].update(re.findall(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', content))
-        consolidated_info["contact_details"].update(re.findall(r'\b(?:\+\d{1,2}\s)?\(?\d{3}\)?[\s.-]\d{3}[\s.-]\d{4}\b', content))
-
-        # Extract current status
-        status_sentences = re.findall(r'([^.]*status[^.]*\.)', content, re.IGNORECASE)
-        if status_sentences:
-            consolidated_info["current_status"] = status_sentences[-1].strip()
-
-        # Extract key details
-        consolidated_info["key_details"] = extract_key_details(content)
+            consolidated_info["summary"] = summarize_stream(iter_texts)
+            for content in iter_texts():
+                scan_chain_email(consolidated_info, content, 0, len(content), CHAIN_TEXT_PATTERNS)
+        elif os.path.getsize(file_path):
+            # Text chains are memory-mapped; each email is the span of the mapping
+            # the shared parser found for it
+            spans = [(record["offset"], record["end"]) for record in parse_chain(file_path)]
+            with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                consolidated_info["summary"] = summarize_stream(
+                    lambda: (as_text(mapped[start:end]).strip() for start, end in spans))
+                for start, end in spans:
+                    scan_chain_email(consolidated_info, mapped, start, end, CHAIN_BYTE_PATTERNS)
 
         # Convert sets to lists for JSON serialization
         for key in consolidated_info:
             if isinstance(consolidated_info[key], set):
                 consolidated_info[key] = list(consolidated_info[key])
+            elif isinstance(consolidated_info[key], defaultdict):
+                consolidated_info[key] = dict(consolidated_info[key])
 
         log("Email chain analysis completed.")
         return consolidated_info
@@ -526,70 +2582,203 @@ def generate_pdf_report(consolidated_info, output_file):
         log(f"Error generating PDF report: {str(e)}", 'error')
         raise
 
-def main():
+def run_case_analysis(messages, search_term, resolver=None, dedup_stats=None):
+    boilerplate = BoilerplateFilter() if STRIP_BOILERPLATE else None
+    if CHAIN_FORMAT in CHAIN_EXTENSIONS:
+        log(f"Stage 2: Exporting email chain to {CHAIN_FORMAT} file...")
+        email_chain_file = f"Email_Chain_{search_term.replace(' ', '_')}{CHAIN_EXTENSIONS[CHAIN_FORMAT]}"
+        export_to_jsonl(messages, email_chain_file, resolver, boilerplate)
+    else:
+        log("Stage 2: Exporting email chain to text file...")
+        email_chain_file = f"Email_Chain_{search_term.replace(' ', '_')}.txt"
+        export_to_text(messages, email_chain_file, resolver, boilerplate)
+    if boilerplate and boilerplate.chars_in:
+        log(f"Boilerplate stripping kept {boilerplate.chars_out} of {boilerplate.chars_in} body characters")
+    
+    log("Stage 3: Analyzing email chain...")
+    consolidated_info = analyze_email_chain(email_chain_file)
+    if dedup_stats is not None:
+        consolidated_info["seen_in"] = duplicate_folders(dedup_stats)
+    
+    log("Stage 4: Generating PDF report...")
+    pdf_file = f"Consolidated_Report_{search_term.replace(' ', '_')}.pdf"
+    generate_pdf_report(consolidated_info, pdf_file)
+    
+    log("Stage 5: Exporting consolidated information...")
+    json_file = f"Consolidated_Info_{search_term.replace(' ', '_')}.json"
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump(consolidated_info, f, indent=2)
+    
+    print(f"\nCase analysis has been generated:")
+    print(f"Email chain: {email_chain_file}")
+    print(f"PDF Report: {pdf_file}")
+    print(f"Analysis Data: {json_file}")
+
+def discover_tickets(outlook, days_back=30, map_file=TICKET_MAP_FILE):
     try:
-        log("Starting email analysis process...")
-        search_term = input("Enter the search term (person name, incident number, keyword, etc.): ")
-        days_back = int(input("Enter the number of days to search back (default is 30): ") or 30)
+        log("Discovering tickets across all folders...")
+        start_date = (datetime.now() - timedelta(days=days_back)).strftime("%m/%d/%Y")
+        date_filter = f"@SQL=\"urn:schemas:httpmail:datereceived\" >= '{start_date}'"
+        tickets = defaultdict(list)
+        scanned = 0
+
+        def scan_folder(folder):
+            nonlocal scanned
+            try:
+                for item in folder.Items.Restrict(date_filter):
+                    try:
+                        # Subject plus the head of the body; quoted history further down
+                        # repeats ticket numbers that already appear in earlier messages
+                        text = f"{item.Subject}\n{(item.Body or '')[:TICKET_SCAN_BYTES]}"
+                        entry_id = item.EntryID
+                    except Exception:
+                        continue
+                    scanned += 1
+                    for ticket in {match.upper() for match in TICKET_PATTERN.findall(text)}:
+                        tickets[ticket].append(entry_id)
+                for subfolder in folder.Folders:
+                    scan_folder(subfolder)
+            except Exception as e:
+                log(f"Error scanning folder {folder.Name}: {str(e)}", 'warning')
+
+        for folder_const, folder_name in DEFAULT_FOLDERS:
+            try:
+                log(f"Scanning {folder_name} and its subfolders...")
+                scan_folder(outlook.GetDefaultFolder(folder_const))
+            except Exception as e:
+                log(f"Error scanning {folder_name}: {str(e)}", 'error')
+                continue
+
+        ticket_map = {
+            "generated": datetime.now().strftime(MIRROR_TIME_FORMAT),
+            "days_back": days_back,
+            "tickets": dict(sorted(tickets.items())),
+        }
+        with open(map_file, 'w', encoding='utf-8') as f:
+            json.dump(ticket_map, f, indent=2)
+        log(f"Scanned {scanned} emails and found {len(tickets)} tickets; map saved to {map_file}")
+        return ticket_map
+    except Exception as e:
+        log(f"Error discovering tickets: {str(e)}", 'error')
+        raise
+
+def analyze_ticket_map(outlook, ticket_map):
+    resolver = AddressResolver(outlook)
+    for ticket, entry_ids in ticket_map["tickets"].items():
+        try:
+            log(f"Analyzing {ticket} ({len(entry_ids)} emails)...")
+            messages = []
+            for entry_id in entry_ids:
+                try:
+                    messages.append(outlook.GetItemFromID(entry_id))
+                except Exception as e:
+                    log(f"Email for {ticket} is no longer available: {str(e)}", 'warning')
+            if messages:
+                dedup_stats = {}
+                run_case_analysis(deduplicate_emails(messages, dedup_stats), ticket, resolver, dedup_stats)
+        except Exception as e:
+            log(f"Error analyzing {ticket}: {str(e)}", 'error')
+            continue
+
+def analyze_search_term(outlook, search_term, days_back=30, adaptive=False):
+    # Identify search type
+    search_type = identify_search_type(search_term)
+    log(f"Search type identified as: {search_type}")
+    
+    log("Stage 1: Fetching emails...")
+    # Emails stream from the fetch stage straight into the analysis/export stage
+    if outlook is not None:
+        messages = iter_emails(outlook, search_term, days_back, search_type=search_type, adaptive=adaptive)
+    else:
+        messages = iter_mail_source(MAIL_SOURCE, MAIL_SOURCE_PATH, search_term, days_back)
+    first_message = next(messages, None)
+
+    if first_message is None:
+        log("No emails found matching the search criteria.", 'warning')
+        return
+
+    dedup_stats = {}
+    messages = deduplicate_emails(itertools.chain([first_message], messages), dedup_stats)
+    resolver = AddressResolver(outlook)
+    if search_type == "person":
+        log("Stage 2: Analyzing person-specific emails...")
+        tasks_analysis = analyze_person_emails(messages, resolver)
+        tasks_analysis["seen_in"] = duplicate_folders(dedup_stats)
+        
+        log("Stage 3: Generating person-specific report...")
+        pdf_file = f"Person_Analysis_{search_term.replace(' ', '_')}.pdf"
+        generate_person_report(tasks_analysis, pdf_file)
         
-        # Identify search type
-        search_type = identify_search_type(search_term)
-        log(f"Search type identified as: {search_type}")
+        log("Stage 4: Exporting analysis data...")
+        json_file = f"Person_Analysis_{search_term.replace(' ', '_')}.json"
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(tasks_analysis, f, indent=2, default=str)
         
-        pythoncom.CoInitialize()
-        outlook = connect_to_outlook()
+        print(f"\nPerson-specific analysis has been generated:")
+        print(f"PDF Report: {pdf_file}")
+        print(f"Analysis Data: {json_file}")
         
-        log("Stage 1: Fetching emails...")
-        messages = fetch_emails(outlook, search_term, days_back)
+    else:  # case
+        run_case_analysis(messages, search_term, resolver, dedup_stats)
 
-        if messages:
-            if search_type == "person":
-                log("Stage 2: Analyzing person-specific emails...")
-                tasks_analysis = analyze_person_emails(messages)
-                
-                log("Stage 3: Generating person-specific report...")
-                pdf_file = f"Person_Analysis_{search_term.replace(' ', '_')}.pdf"
-                generate_person_report(tasks_analysis, pdf_file)
-                
-                log("Stage 4: Exporting analysis data...")
-                json_file = f"Person_Analysis_{search_term.replace(' ', '_')}.json"
-                with open(json_file, 'w', encoding='utf-8') as f:
-                    json.dump(tasks_analysis, f, indent=2, default=str)
-                
-                print(f"\nPerson-specific analysis has been generated:")
-                print(f"PDF Report: {pdf_file}")
-                print(f"Analysis Data: {json_file}")
-                
-            else:  # case
-                log("Stage 2: Exporting email chain to text file...")
-                email_chain_file = f"Email_Chain_{search_term.replace(' ', '_')}.txt"
-                export_to_text(messages, email_chain_file)
-                
-                log("Stage 3: Analyzing email chain...")
-                consolidated_info = analyze_email_chain(email_chain_file)
-                
-                log("Stage 4: Generating PDF report...")
-                pdf_file = f"Consolidated_Report_{search_term.replace(' ', '_')}.pdf"
-                generate_pdf_report(consolidated_info, pdf_file)
-                
-                log("Stage 5: Exporting consolidated information...")
-                json_file = f"Consolidated_Info_{search_term.replace(' ', '_')}.json"
-                with open(json_file, 'w', encoding='utf-8') as f:
-                    json.dump(consolidated_info, f, indent=2)
-                
-                print(f"\nCase analysis has been generated:")
-                print(f"Email chain: {email_chain_file}")
-                print(f"PDF Report: {pdf_file}")
-                print(f"Analysis Data: {json_file}")
-        else:
-            log("No emails found matching the search criteria.", 'warning')
+def main():
+    session = OutlookSession()
+    try:
+        log("Starting email analysis process...")
+        search_term = input("Enter the search term (person name, incident number, keyword, etc., or * for every ticket): ").strip()
+        days_input = input("Enter the number of days to search back (default is 30, 'auto' to widen as needed): ").strip()
+        adaptive = days_input.lower() == "auto"
+        days_back = ADAPTIVE_MAX_DAYS if adaptive else int(days_input or 30)
+        
+        if search_term == "*":
+            # One pass over the mailbox builds the ticket map, then every case is reported
+            if MAIL_SOURCE != "outlook":
+                log("Ticket discovery is only available for the Outlook mail source.", 'error')
+                return
+            outlook = session.open()
+            analyze_ticket_map(outlook, discover_tickets(outlook, days_back))
+            return
+        
+        analyze_search_term(session.open() if MAIL_SOURCE == "outlook" else None,
+                            search_term, days_back, adaptive)
             
     except Exception as e:
         log(f"An unexpected error occurred: {str(e)}", 'error')
         log("Error details:", 'error')
         log(traceback.format_exc(), 'error')
     finally:
-        pythoncom.CoUninitialize()
+        session.close()
+
+def run_batch(search_terms, days_back=30):
+    # Every search reuses the same Outlook session; one failed search is logged
+    # and the batch moves on to the next term
+    with OutlookSession() as session:
+        outlook = session if MAIL_SOURCE == "outlook" else None
+        for search_term in search_terms:
+            try:
+                analyze_search_term(outlook, search_term, days_back)
+            except Exception as e:
+                log(f"Error analyzing {search_term}: {str(e)}", 'error')
+                log(traceback.format_exc(), 'error')
+        log(f"Batch of {len(search_terms)} searches finished ({session.reconnects} reconnects)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 2 and sys.argv[1] == "--benchmark":
+        # python Outlook_Auto_10.py --benchmark INC13461592 [days_back]
+        # Set OUTLOOK_REPLAY=snapshot.json to benchmark against a recorded mailbox;
+        # AdvancedSearch needs the live Application, so replay compares the other modes
+        modes = ("restrict", "table", "parallel") if REPLAY_SNAPSHOT else ("restrict", "advanced")
+        with OutlookSession() as session:
+            benchmark_fetch_modes(session, sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 30, modes)
+    elif len(sys.argv) > 2 and sys.argv[1] == "--record":
+        # python Outlook_Auto_10.py --record snapshot.json [days_back]
+        with OutlookSession() as session:
+            outlook_replay.record_snapshot(session, sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 30)
+        log(f"Recorded Outlook snapshot to {sys.argv[2]}")
+    elif len(sys.argv) > 2 and sys.argv[1] == "--batch":
+        # python Outlook_Auto_10.py --batch tickets.txt [days_back], one search term per line
+        with open(sys.argv[2], encoding='utf-8') as f:
+            search_terms = [line.strip() for line in f if line.strip()]
+        run_batch(search_terms, int(sys.argv[3]) if len(sys.argv) > 3 else 30)
+    else:
+        main()
\ No newline at end of file
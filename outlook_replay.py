@@ -0,0 +1,521 @@
+"""Record an Outlook mailbox to a JSON snapshot and replay it without Outlook.
+
+record_snapshot() walks the default folders of a live MAPI namespace and saves
+folders and messages. ReplayNamespace loads such a snapshot and implements the
+part of the Outlook object model the email scripts use (GetDefaultFolder,
+Folders, Items.Sort/Restrict, GetTable, GetItemFromID, message properties), so
+the fetch code can be tested and benchmarked on a machine without Outlook.
+Every COM round trip sleeps for a configurable latency.
+"""
+import json
+import re
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+SNAPSHOT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+SNAPSHOT_FOLDERS = [6, 5, 3, 4, 2]  # Inbox, Sent Items, Deleted Items, Outbox, Drafts
+PR_SENDER_SMTP_ADDRESS = "http://schemas.microsoft.com/mapi/proptag/0x5D01001F"
+PR_INTERNET_MESSAGE_ID = "http://schemas.microsoft.com/mapi/proptag/0x1035001F"
+PR_LOCAL_COMMIT_TIME_MAX = "http://schemas.microsoft.com/mapi/proptag/0x670A0040"
+
+# MailItem property -> snapshot key
+MESSAGE_PROPERTIES = {
+    "EntryID": "entry_id",
+    "Subject": "subject",
+    "Body": "body",
+    "SenderEmailAddress": "sender_email_address",
+    "SenderName": "sender_name",
+    "To": "to",
+    "CC": "cc",
+    "ReceivedTime": "received_time",
+    "ConversationID": "conversation_id",
+    "ConversationTopic": "conversation_topic",
+    "Size": "size",
+}
+MAPI_PROPERTIES = {
+    PR_SENDER_SMTP_ADDRESS: "sender_smtp_address",
+    PR_INTERNET_MESSAGE_ID: "internet_message_id",
+}
+FOLDER_MAPI_PROPERTIES = {
+    PR_LOCAL_COMMIT_TIME_MAX: "last_changed",
+}
+# DASL field (urn:schemas:httpmail:...) -> snapshot key
+DASL_FIELDS = {
+    "subject": "subject",
+    "textdescription": "body",
+    "fromname": "sender_name",
+    "fromaddress": "sender_smtp_address",
+    "displayto": "to",
+    "displaycc": "cc",
+    "displaybcc": "bcc",
+    "datereceived": "received_time",
+    "thread-topic": "conversation_topic",
+}
+
+def record_message(item):
+    message = {}
+    for name, key in MESSAGE_PROPERTIES.items():
+        value = getattr(item, name, None)
+        if name == "ReceivedTime" and value is not None:
+            value = datetime(value.year, value.month, value.day, value.hour, value.minute,
+                             value.second).strftime(SNAPSHOT_TIME_FORMAT)
+        message[key] = value
+    for name, key in MAPI_PROPERTIES.items():
+        try:
+            message[key] = item.PropertyAccessor.GetProperty(name)
+        except Exception:
+            message[key] = None
+    return message
+
+def record_folder(folder, filter_string):
+    recorded = {
+        "name": folder.Name,
+        "folder_path": folder.FolderPath,
+        "entry_id": folder.EntryID,
+        "store_id": folder.StoreID,
+        "messages": [],
+        "folders": [],
+    }
+    for name, key in FOLDER_MAPI_PROPERTIES.items():
+        try:
+            recorded[key] = str(folder.PropertyAccessor.GetProperty(name))
+        except Exception:
+            recorded[key] = None
+    try:
+        for item in folder.Items.Restrict(filter_string):
+            try:
+                recorded["messages"].append(record_message(item))
+            except Exception:
+                continue
+    except Exception:
+        pass
+    for subfolder in folder.Folders:
+        recorded["folders"].append(record_folder(subfolder, filter_string))
+    return recorded
+
+def record_snapshot(outlook, path, days_back=30):
+    start = (datetime.now() - timedelta(days=days_back)).strftime("%m/%d/%Y")
+    filter_string = f"@SQL=\"urn:schemas:httpmail:datereceived\" >= '{start}'"
+    current_user = outlook.CurrentUser
+    snapshot = {
+        "recorded": datetime.now().strftime(SNAPSHOT_TIME_FORMAT),
+        "days_back": days_back,
+        "current_user": {"name": current_user.Name, "address": current_user.Address},
+        "default_folders": {},
+        "folders": [],
+    }
+    for folder_const in SNAPSHOT_FOLDERS:
+        folder = outlook.GetDefaultFolder(folder_const)
+        snapshot["default_folders"][str(folder_const)] = folder.EntryID
+        snapshot["folders"].append(record_folder(folder, filter_string))
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, indent=2, default=str)
+    return snapshot
+
+DASL_TOKEN = re.compile(r"\s*(?:(\()|(\))|\"([^\"]+)\"|'((?:[^']|'')*)'|(>=|<=|<>|=|<|>)|(\w+))")
+DASL_DATE_FORMATS = ("%m/%d/%Y %I:%M %p", "%m/%d/%Y %H:%M", "%m/%d/%Y")
+
+def tokenize_dasl(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = DASL_TOKEN.match(text, position)
+        if not match:
+            raise ValueError(f"Cannot parse DASL filter near: {text[position:]}")
+        position = match.end()
+        if match.group(1):
+            tokens.append(("(", None))
+        elif match.group(2):
+            tokens.append((")", None))
+        elif match.group(3):
+            tokens.append(("property", match.group(3)))
+        elif match.group(4) is not None:
+            tokens.append(("string", match.group(4).replace("''", "'")))
+        elif match.group(5):
+            tokens.append(("operator", match.group(5)))
+        else:
+            tokens.append(("word", match.group(6).upper()))
+    return tokens
+
+def parse_dasl_date(value):
+    for date_format in DASL_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"Unsupported DASL date: {value}")
+
+def compile_dasl(filter_string):
+    """Compile an @SQL= filter into a predicate over snapshot message dicts.
+
+    Supports AND/OR/NOT, parentheses, LIKE with % wildcards, ci_phrasematch,
+    equality on text fields, and date comparisons on datereceived.
+    """
+    if filter_string.startswith("@SQL="):
+        filter_string = filter_string[5:]
+    tokens = tokenize_dasl(filter_string)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def expression():
+        left = term()
+        while peek() == ("word", "OR"):
+            take()
+            right = term()
+            left = (lambda a, b: lambda message: a(message) or b(message))(left, right)
+        return left
+
+    def term():
+        left = factor()
+        while peek() == ("word", "AND"):
+            take()
+            right = factor()
+            left = (lambda a, b: lambda message: a(message) and b(message))(left, right)
+        return left
+
+    def factor():
+        if peek() == ("word", "NOT"):
+            take()
+            negated = factor()
+            return lambda message: not negated(message)
+        if peek()[0] == "(":
+            take()
+            inner = expression()
+            take()
+            return inner
+        _, prop = take()
+        key = DASL_FIELDS[prop.rsplit(":", 1)[-1].lower()]
+        _, operator = take()
+        _, value = take()
+        if operator == "LIKE":
+            pattern = re.compile("^" + re.escape(value).replace("%", ".*") + "$", re.IGNORECASE | re.DOTALL)
+            return lambda message: bool(pattern.match(message.get(key) or ""))
+        if operator == "CI_PHRASEMATCH":
+            pattern = re.compile(r"\b" + re.escape(value) + r"\b", re.IGNORECASE)
+            return lambda message: bool(pattern.search(message.get(key) or ""))
+        if key != "received_time" and operator in ("=", "<>"):
+            equal = operator == "="
+            return lambda message: ((message.get(key) or "").lower() == value.lower()) == equal
+        bound = parse_dasl_date(value).strftime(SNAPSHOT_TIME_FORMAT)
+        compare = {
+            ">=": lambda a: a >= bound, ">": lambda a: a > bound,
+            "<=": lambda a: a <= bound, "<": lambda a: a < bound,
+            "=": lambda a: a == bound, "<>": lambda a: a != bound,
+        }[operator]
+        return lambda message: message.get(key) is not None and compare(message[key])
+
+    predicate = expression()
+    if position != len(tokens):
+        raise ValueError(f"Unexpected DASL token: {tokens[position]}")
+    return predicate
+
+def sort_key(message, key):
+    # Items without the property sort after everything else when descending
+    value = message.get(key)
+    return (value is not None, value)
+
+@lru_cache(maxsize=None)
+def load_snapshot(path):
+    # Worker threads each open their own namespace; they share one parsed copy
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+class ReplayObject:
+    """Base for replayed COM objects; tick() charges one COM round trip."""
+
+    def __init__(self, namespace):
+        self._namespace = namespace
+
+    def tick(self):
+        self._namespace.calls += 1
+        if self._namespace.latency:
+            time.sleep(self._namespace.latency)
+
+class ReplayPropertyAccessor(ReplayObject):
+    def __init__(self, namespace, message, properties=MAPI_PROPERTIES):
+        super().__init__(namespace)
+        self._message = message
+        self._properties = properties
+
+    def GetProperty(self, name):
+        self.tick()
+        if name not in self._properties:
+            raise AttributeError(f"Property {name} is not recorded")
+        value = self._message.get(self._properties[name])
+        if value is None:
+            # Outlook raises for a property the item does not have, e.g. the
+            # Internet message ID of a draft; it never returns None
+            raise AttributeError(f"The property {name} is unknown or cannot be found")
+        return value
+
+class ReplayMailItem(ReplayObject):
+    def __init__(self, namespace, message, folder):
+        super().__init__(namespace)
+        self._message = message
+        self._folder = folder
+
+    def __getattr__(self, name):
+        if name not in MESSAGE_PROPERTIES:
+            raise AttributeError(name)
+        self.tick()
+        value = self._message.get(MESSAGE_PROPERTIES[name])
+        if name == "ReceivedTime" and value is not None:
+            return datetime.strptime(value, SNAPSHOT_TIME_FORMAT)
+        return value
+
+    @property
+    def Parent(self):
+        self.tick()
+        return self._folder
+
+    @property
+    def Session(self):
+        return self._namespace
+
+    @property
+    def PropertyAccessor(self):
+        self.tick()
+        return ReplayPropertyAccessor(self._namespace, self._message)
+
+class ReplayItems(ReplayObject):
+    def __init__(self, namespace, folder, messages):
+        super().__init__(namespace)
+        self._folder = folder
+        self._messages = list(messages)
+        self._cursor = 0
+
+    @property
+    def Count(self):
+        self.tick()
+        return len(self._messages)
+
+    def Sort(self, prop, descending=False):
+        self.tick()
+        key = MESSAGE_PROPERTIES[prop.strip("[]")]
+        self._messages.sort(key=lambda message: sort_key(message, key), reverse=bool(descending))
+
+    def Restrict(self, filter_string):
+        self.tick()
+        predicate = compile_dasl(filter_string)
+        return ReplayItems(self._namespace, self._folder, (m for m in self._messages if predicate(m)))
+
+    def _item(self, index):
+        if index >= len(self._messages):
+            return None
+        self.tick()
+        return ReplayMailItem(self._namespace, self._messages[index], self._folder)
+
+    def GetFirst(self):
+        self._cursor = 0
+        return self._item(0)
+
+    def GetNext(self):
+        self._cursor += 1
+        return self._item(self._cursor)
+
+    def Item(self, index):
+        return self._item(index - 1)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        for index in range(len(self._messages)):
+            yield self._item(index)
+
+class ReplayColumns(ReplayObject):
+    def __init__(self, namespace):
+        super().__init__(namespace)
+        self.names = []
+
+    def RemoveAll(self):
+        self.tick()
+        self.names = []
+
+    def Add(self, name):
+        self.tick()
+        self.names.append(name)
+
+class ReplayTable(ReplayObject):
+    def __init__(self, namespace, messages):
+        super().__init__(namespace)
+        self._messages = list(messages)
+        self._row = 0
+        self.Columns = ReplayColumns(namespace)
+
+    def Sort(self, prop, descending=False):
+        self.tick()
+        key = MESSAGE_PROPERTIES[prop.strip("[]")]
+        self._messages.sort(key=lambda message: sort_key(message, key), reverse=bool(descending))
+
+    @property
+    def EndOfTable(self):
+        return self._row >= len(self._messages)
+
+    def column_value(self, message, name):
+        if name in MAPI_PROPERTIES:
+            return message.get(MAPI_PROPERTIES[name])
+        value = message.get(MESSAGE_PROPERTIES[name])
+        if name == "ReceivedTime" and value is not None:
+            return datetime.strptime(value, SNAPSHOT_TIME_FORMAT)
+        return value
+
+    def GetArray(self, max_rows):
+        # One round trip for the whole batch, as with the real Table object
+        self.tick()
+        rows = self._messages[self._row:self._row + max_rows]
+        self._row += len(rows)
+        return [tuple(self.column_value(message, name) for name in self.Columns.names) for message in rows]
+
+class ReplayFolders(ReplayObject):
+    def __init__(self, namespace, folders):
+        super().__init__(namespace)
+        self._folders = folders
+
+    @property
+    def Count(self):
+        self.tick()
+        return len(self._folders)
+
+    def Item(self, index):
+        self.tick()
+        return self._folders[index - 1]
+
+    def __iter__(self):
+        for folder in self._folders:
+            self.tick()
+            yield folder
+
+class ReplayFolder(ReplayObject):
+    def __init__(self, namespace, recorded):
+        super().__init__(namespace)
+        self._recorded = recorded
+        self._subfolders = [ReplayFolder(namespace, child) for child in recorded["folders"]]
+        self.DefaultItemType = 0
+
+    @property
+    def Name(self):
+        self.tick()
+        return self._recorded["name"]
+
+    @property
+    def FolderPath(self):
+        self.tick()
+        return self._recorded["folder_path"]
+
+    @property
+    def EntryID(self):
+        self.tick()
+        return self._recorded["entry_id"]
+
+    @property
+    def StoreID(self):
+        self.tick()
+        return self._recorded["store_id"]
+
+    @property
+    def Items(self):
+        self.tick()
+        return ReplayItems(self._namespace, self, self._recorded["messages"])
+
+    @property
+    def PropertyAccessor(self):
+        self.tick()
+        return ReplayPropertyAccessor(self._namespace, self._recorded, FOLDER_MAPI_PROPERTIES)
+
+    @property
+    def Folders(self):
+        self.tick()
+        return ReplayFolders(self._namespace, self._subfolders)
+
+    def GetTable(self, filter_string, table_contents=0):
+        self.tick()
+        predicate = compile_dasl(filter_string)
+        return ReplayTable(self._namespace, (m for m in self._recorded["messages"] if predicate(m)))
+
+class ReplayRecipient:
+    def __init__(self, address):
+        self.Address = address
+        self.Name = address
+        self.AddressEntry = self
+
+    def GetExchangeUser(self):
+        return None
+
+    def Resolve(self):
+        return True
+
+class ReplayStore:
+    def __init__(self, namespace, store_id):
+        self._namespace = namespace
+        self.StoreID = store_id
+        self.DisplayName = "Replay"
+
+class ReplayNamespace:
+    """Stand-in for Outlook's MAPI namespace backed by a recorded snapshot.
+
+    calls counts the simulated COM round trips; latency is the delay in seconds
+    charged for each of them.
+    """
+
+    def __init__(self, snapshot, latency=0.0):
+        if isinstance(snapshot, str):
+            snapshot = load_snapshot(snapshot)
+        self.latency = latency
+        self.calls = 0
+        self._snapshot = snapshot
+        self._root_folders = [ReplayFolder(self, recorded) for recorded in snapshot["folders"]]
+        self._folders_by_id = {}
+        self._items_by_id = {}
+        pending = list(self._root_folders)
+        while pending:
+            folder = pending.pop()
+            self._folders_by_id[folder._recorded["entry_id"]] = folder
+            for message in folder._recorded["messages"]:
+                self._items_by_id[message["entry_id"]] = (message, folder)
+            pending.extend(folder._subfolders)
+        user = snapshot.get("current_user") or {}
+        self.CurrentUser = ReplayRecipient(user.get("address", ""))
+        self.CurrentUser.Name = user.get("name", "")
+        store_id = self._root_folders[0]._recorded["store_id"] if self._root_folders else None
+        self.DefaultStore = ReplayStore(self, store_id)
+        self.Stores = [self.DefaultStore]
+
+    def tick(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def Folders(self):
+        self.tick()
+        return ReplayFolders(self, self._root_folders)
+
+    def GetDefaultFolder(self, folder_const):
+        self.tick()
+        entry_id = self._snapshot["default_folders"].get(str(folder_const))
+        if entry_id not in self._folders_by_id:
+            raise KeyError(f"Default folder {folder_const} is not in the snapshot")
+        return self._folders_by_id[entry_id]
+
+    def GetFolderFromID(self, entry_id, store_id=None):
+        self.tick()
+        return self._folders_by_id[entry_id]
+
+    def GetItemFromID(self, entry_id, store_id=None):
+        self.tick()
+        message, folder = self._items_by_id[entry_id]
+        return ReplayMailItem(self, message, folder)
+
+    def CreateRecipient(self, name):
+        self.tick()
+        return ReplayRecipient(name)